@@ -30,7 +30,7 @@ from glbl_ecss_cmmn_funcs import check_lu_pi_json_fname, write_study_definition_
 from mngmnt_fns_and_class import check_csv_coords_fname
 
 from grid_cell_classes_fns import generate_osgb_sites
-from grid_cell_high_level_fns import generate_grid_cell_sims
+from grid_cell_high_level_fns import generate_grid_cell_sims, generate_spatial_sims
 
 from weather_datasets import change_wthr_rsrc
 from initialise_funcs import initiation, read_config_file, build_and_display_studies, write_runsites_config_file
@@ -350,7 +350,8 @@ class Form(QWidget):
             return
 
         if run_id == SPATIAL:
-            pass  # relic
+            generate_spatial_sims(self)
+            write_study_definition_file(self)
         else:
             # CSV_FILE or RNDM_CELLS
             # ======================
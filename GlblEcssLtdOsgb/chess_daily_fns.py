@@ -0,0 +1,72 @@
+#-------------------------------------------------------------------------------
+# Name:        chess_daily_fns.py
+# Purpose:     streaming aggregation of daily CHESS datasets to monthly values
+# Licence:     <your licence>
+# Description:
+#   daily values are read in chunks of whole months, reduced to monthly means for every cell of a spatial block,
+#   and fed to the monthly met file path; peak memory is bounded by one chunk
+#   CHESS precipitation is a flux, kg m-2 s-1, so its monthly mean is directly comparable with the monthly product
+#-------------------------------------------------------------------------------
+
+__prog__ = 'chess_daily_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from netCDF4 import num2date
+from numpy import array, empty, diff, flatnonzero, concatenate, searchsorted, add, float32, float64, int64, nan
+from numpy.ma import filled
+
+CHUNK_DAYS = 366    # maximum number of days read in one go
+
+_month_bounds = {}  # keyed by file path
+
+def fetch_month_bounds(nc_dset):
+    """
+    time indices at which each month begins followed by the number of time steps
+    i.e. month imnth comprises time indices month_bounds[imnth] to month_bounds[imnth + 1] - 1
+    """
+    key = nc_dset.filepath()
+    if key not in _month_bounds:
+        time_var = nc_dset.variables['time']
+        calendar = time_var.calendar if 'calendar' in time_var.ncattrs() else 'standard'
+        dates = num2date(time_var[:], time_var.units, calendar)
+        mnth_ids = array([date.year*12 + date.month - 1 for date in dates], dtype=int64)
+        mnth_starts = flatnonzero(diff(mnth_ids)) + 1
+        _month_bounds[key] = concatenate(([0], mnth_starts, [len(mnth_ids)])).astype(int64)
+
+    return _month_bounds[key]
+
+def fetch_month_indx(month_bounds, time_indx):
+    """
+    index of the month containing a daily time index
+    """
+    return int(searchsorted(month_bounds, time_indx, side='right')) - 1
+
+def aggregate_daily_to_monthly(nc_var, month_bounds, mnth_strt, mnth_stop, nrth_slice, east_slice):
+    """
+    monthly means of months mnth_strt to mnth_stop - 1 for a spatial block, as a months by rows by columns array
+    chunks comprise whole months up to CHUNK_DAYS days; sums are accumulated in float64
+    masked values become NaN, consistent with _read_block in getClimGenOsbgFns.py, so any gap gives a NaN month
+    """
+    nrows = len(range(*nrth_slice.indices(nc_var.shape[-2])))
+    ncols = len(range(*east_slice.indices(nc_var.shape[-1])))
+    monthly = empty((max(0, mnth_stop - mnth_strt), nrows, ncols), dtype=float32)
+
+    imnth = mnth_strt
+    while imnth < mnth_stop:
+        jmnth = imnth + 1
+        while jmnth < mnth_stop and month_bounds[jmnth + 1] - month_bounds[imnth] <= CHUNK_DAYS:
+            jmnth += 1
+
+        day_strt, day_stop = month_bounds[imnth], month_bounds[jmnth]
+        chunk = filled(nc_var[day_strt:day_stop, nrth_slice, east_slice].astype(float32), nan)
+
+        ndays = diff(month_bounds[imnth:jmnth + 1])
+        sums = add.reduceat(chunk, month_bounds[imnth:jmnth] - day_strt, axis=0, dtype=float64)
+        monthly[imnth - mnth_strt:jmnth - mnth_strt] = sums / ndays[:, None, None]
+
+        imnth = jmnth
+
+    return monthly
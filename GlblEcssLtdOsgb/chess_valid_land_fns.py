@@ -0,0 +1,142 @@
+#-------------------------------------------------------------------------------
+# Name:        chess_valid_land_fns.py
+# Purpose:     persistent bitmap of CHESS grid cells which have weather data
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+__prog__ = 'chess_valid_land_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from os.path import isfile, join, normpath, getsize, getmtime, lexists
+from os import makedirs
+from hashlib import md5
+from time import time
+
+from numpy import asarray, float64, int64, trunc, isfinite, where, zeros, packbits, unpackbits, savez, load as np_load, array
+from numpy.ma import getmaskarray
+
+from nc_dset_pool import fetch_nc_var, fetch_nc_coords
+
+ERROR_STR = '*** Error *** '
+WARN_STR = '*** Warning *** '
+
+BITMAP_PREFIX = 'chess_valid_land_'
+NDAYS_TO_CHECK = 25     # cell is valid if none of this number of time steps are masked
+SCAN_ROWS = 64          # number of rows of the grid read in one go when building the bitmap
+
+def fetch_grid_geometry(vars_wthr):
+    """
+    easting and northing size in metres and the minimum easting and northing of the weather grid
+    """
+    gridsize = abs(float(vars_wthr['x'][0] - vars_wthr['x'][1]))
+    min_easting = float(vars_wthr['x'][0]) - (gridsize / 2.0)
+    min_nrthing = float(vars_wthr['y'][0]) - (gridsize / 2.0)
+
+    return gridsize, min_easting, min_nrthing
+
+def fetch_file_identity(fname):
+    """
+    identity of a file comprising normalised path, size and modification time
+    """
+    fname = normpath(fname)
+
+    return fname, getsize(fname), int(getmtime(fname))
+
+def _bitmap_fname(cache_dir, nc_fname):
+    """
+    bitmaps are keyed by the path of the NetCDF file they describe
+    """
+    path_hash = md5(normpath(nc_fname).encode('utf-8')).hexdigest()[:16]
+
+    return join(cache_dir, BITMAP_PREFIX + path_hash + '.npz')
+
+class ChessValidLand(object,):
+
+    def __init__(self, lggr, nc_fname, cache_dir, metric = 'precip'):
+        """
+        bitmap of (nrth, east) cells with data, read from the cache directory if the file identity matches
+        otherwise built by scanning the NetCDF file once and saved
+        """
+        self.lggr = lggr
+        self.nc_fname = normpath(nc_fname)
+        self.valid = None
+
+        fname, size, mtime = fetch_file_identity(nc_fname)
+        bitmap_fn = _bitmap_fname(cache_dir, nc_fname)
+        if isfile(bitmap_fn):
+            if self._read_bitmap(bitmap_fn, fname, size, mtime):
+                return
+
+        self._build_bitmap(metric)
+
+        if not lexists(cache_dir):
+            makedirs(cache_dir)
+
+        nrows, ncols = self.valid.shape
+        savez(bitmap_fn, bits = packbits(self.valid), nrows = nrows, ncols = ncols,
+              identity = array([fname, str(size), str(mtime)]),
+              geometry = array([self.gridsize, self.min_easting, self.min_nrthing]))
+
+        mess = 'Wrote valid land bitmap of {} cells to {}'.format(int(self.valid.sum()), bitmap_fn)
+        print(mess); lggr.info(mess)
+
+    def _read_bitmap(self, bitmap_fn, fname, size, mtime):
+        """
+        return True if bitmap file exists and describes the current version of the NetCDF file
+        """
+        with np_load(bitmap_fn) as bitmap:
+            if list(bitmap['identity']) != [fname, str(size), str(mtime)]:
+                self.lggr.info(WARN_STR + 'valid land bitmap ' + bitmap_fn + ' is out of date - will rebuild')
+                return False
+
+            nrows, ncols = int(bitmap['nrows']), int(bitmap['ncols'])
+            self.valid = unpackbits(bitmap['bits'], count = nrows*ncols).reshape(nrows, ncols).astype(bool)
+            self.gridsize, self.min_easting, self.min_nrthing = [float(val) for val in bitmap['geometry']]
+
+        self.lggr.info('Read valid land bitmap ' + bitmap_fn)
+
+        return True
+
+    def _build_bitmap(self, metric):
+        """
+        one-time scan of the NetCDF file, one strip of rows at a time
+        """
+        print('Building valid land bitmap from ' + self.nc_fname + ' - this is done once per dataset...')
+        start_time = time()
+
+        self.gridsize, self.min_easting, self.min_nrthing = fetch_grid_geometry(fetch_nc_coords(self.nc_fname))
+
+        nc_var = fetch_nc_var(self.nc_fname, metric)
+        ntsteps, nrows, ncols = nc_var.shape
+        ndays = min(NDAYS_TO_CHECK, ntsteps)
+
+        valid = zeros((nrows, ncols), dtype = bool)
+        for nrth_lo in range(0, nrows, SCAN_ROWS):
+            nrth_hi = min(nrth_lo + SCAN_ROWS, nrows)
+            block = nc_var[:ndays, nrth_lo:nrth_hi, :]
+            valid[nrth_lo:nrth_hi, :] = ~getmaskarray(block).any(axis=0)
+
+        self.valid = valid
+
+        self.lggr.info('Built valid land bitmap in {} seconds'.format(round(time() - start_time, 1)))
+
+    def check_cells(self, eastings, nrthings):
+        """
+        O(1) per cell validation which does not touch the NetCDF file
+        returns a boolean validity array and arrays of easting and northing indices
+        """
+        eastings = asarray(eastings, dtype=float64)
+        nrthings = asarray(nrthings, dtype=float64)
+
+        finite = isfinite(eastings) & isfinite(nrthings)     # missing coordinates give index -1
+        indx_easts = where(finite, trunc((eastings - self.min_easting) / self.gridsize), -1).astype(int64)
+        indx_nrths = where(finite, trunc((nrthings - self.min_nrthing) / self.gridsize), -1).astype(int64)
+
+        nrows, ncols = self.valid.shape
+        valid_flags = (indx_easts >= 0) & (indx_easts < ncols) & (indx_nrths >= 0) & (indx_nrths < nrows)
+        valid_flags[valid_flags] = self.valid[indx_nrths[valid_flags], indx_easts[valid_flags]]
+
+        return valid_flags, indx_easts, indx_nrths
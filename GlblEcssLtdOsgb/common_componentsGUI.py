@@ -23,6 +23,7 @@ from PyQt5.QtWidgets import QLabel, QLineEdit, QComboBox, QPushButton, QCheckBox
 
 from initialise_funcs import read_config_file, write_config_file
 from glbl_ecss_cmmn_funcs import write_study_definition_file
+from nc_dset_pool import evict_nc_dsets
 
 WDGT_SIZE_40 = 40
 WDGT_SIZE_60 = 60
@@ -50,10 +51,8 @@ def input_choices(form, grid, irow):
     grid.addWidget(w_lbl06b, irow, 0)
 
     w_use_spatial = QRadioButton('Spatial')
-    helpText = 'Use the 30 meter resolution iSDAsoil mapping system for Africa'
-    helpText += ' - see: https://www.isda-africa.com/isdasoil/'
+    helpText = 'Simulate every CHESS cell with weather data within the bounding box'
     w_use_spatial.setToolTip(helpText)
-    w_use_spatial.setEnabled(False)
     grid.addWidget(w_use_spatial, irow, 1)
     form.w_use_spatial = w_use_spatial
 
@@ -337,6 +336,9 @@ def exit_clicked(form, write_config_flag = True):
         for key in form.fobjs:
             form.fobjs[key].close()
 
+    # release NetCDF datasets kept open during the session
+    evict_nc_dsets()
+
     # close logging
     try:
         form.lgr.handlers[0].close()
@@ -12,34 +12,40 @@ __prog__ = 'getClimGenOsbgFns.py'
 __author__ = 's03mm5'
 
 from PyQt5.QtWidgets import QApplication
-from calendar import isleap, monthrange
 from math import floor, ceil
-from netCDF4 import Dataset
-from csv import writer as csv_writer
+from netCDF4 import num2date
 from os.path import exists, normpath, split, join, lexists, basename
 from os import makedirs
 from glob import glob
-from copy import copy
-
-from thornthwaite import thornthwaite
-from cvrtcoord import WGS84toOSGB36
+from numpy import asarray, ascontiguousarray, concatenate, empty, isnan, float32, float64, int64, nan
+from numpy.ma import filled
+
+from thornthwaite_batch_fns import fetch_met_arrays
+from met_file_fns import fetch_met_values, write_met_file
+from osgb_coord_fns import wgs84_to_osgb36
+from rechunk_chess_fns import fetch_cell_major_fname, CELL_MAJOR_DIR
+from chess_valid_land_fns import fetch_file_identity
+from wthr_cell_cache import WthrCellCache
+from nc_dset_pool import fetch_nc_dset, fetch_nc_var
+from chess_daily_fns import fetch_month_bounds, fetch_month_indx, aggregate_daily_to_monthly
 
 ERROR_STR = '*** Error *** '
+WARN_STR = '*** Warning *** '
 METRICS = ['precip', 'tas']
 METRICS_LTA = METRICS + ['pet']
+LTA_DECIMALS = {'precip': 1, 'tas': 2}      # rounding of LTAs written to input.txt
 MNTHS_YR = 12
-numSecsDay = 3600*24
+MAX_BLOCK_SIDE = 64     # maximum side, in grid cells, of a spatial tile and of a block of an unchunked file
+MAX_SLAB_MB = 256       # maximum size of one time slab of a block, see _read_monthly_cells
+
+_lta_arrays = {}        # in-memory LTA grids keyed by file name
 
 def _make_met_files_osgb(clim_dir, lat, climgen, pettmp_grid_cell = None):
     """
     feed annual temperatures to Thornthwaite equations to estimate Potential Evapotranspiration [mm/month]
     """
-    func_name = __prog__ + '  _make_met_files_osgb'
-
-    if not climgen.mnthly_flag:
-        print(ERROR_STR + func_name + ' is monthly only')
-        return
-
+    # series are monthly, daily datasets are aggregated on extraction, see _read_monthly_block
+    # ========================================================================================
     nyears = climgen.max_num_years
     met_fnames = []
 
@@ -57,64 +63,251 @@ def _make_met_files_osgb(clim_dir, lat, climgen, pettmp_grid_cell = None):
     if pettmp_grid_cell is None:        # check for met files only
         return met_fnames
 
-    pettmp_precip = pettmp_grid_cell['precip']
-    pettmp_tas = [val - 273.15 for val in pettmp_grid_cell['tas']]     # CHESS Near-Surface air temperature is in Kelvin
+    # float32 series of a single cell
+    # ===============================
+    precips, pets, temp_means = fetch_met_arrays(asarray(pettmp_grid_cell['precip'])[None, :],
+                                    asarray(pettmp_grid_cell['tas'])[None, :], [lat], climgen.hist_start_year)
+
+    return _write_met_files(clim_dir, climgen, precips[0], pets[0], temp_means[0])
 
-    # create met files
-    # ================
+def _write_met_files(clim_dir, climgen, precips, pets, temp_means):
+    """
+    write one met file per year from arrays of years by months, see fetch_met_arrays
+    the text of each file is rendered in one go and written with a single call, see write_met_file
+    """
+    nyears = climgen.max_num_years
     strt_year = climgen.hist_start_year
-    nmnths = len(pettmp_precip)
-    indx1 = 0
+    nyears_avail = len(temp_means)
+    met_values = fetch_met_values(precips, pets, temp_means)
+    met_fnames = []
 
-    for year in range(strt_year, strt_year + nyears):
+    for iyear, year in enumerate(range(strt_year, strt_year + nyears)):
         fname = 'met{}s.txt'.format(year)
         met_fnames.append(fname)
         met_path = join(clim_dir, fname)
-        monthrange(year, 2)
 
-        indx2 = indx1 + MNTHS_YR
-        if indx2 > nmnths:
-            print('indx2: {}\tnmnths: {}'.format(indx2, nmnths))
+        if iyear >= nyears_avail:
+            print('indx2: {}\tnmnths: {}'.format((iyear + 1)*MNTHS_YR, nyears_avail*MNTHS_YR))
             break
 
-        # air temperature
-        # ===============
-        if indx2 == nmnths:
-            temp_mean     = pettmp_tas[indx1:]
-            precip_for_yr = pettmp_precip[indx1:]
-        else:
-            temp_mean     = pettmp_tas[indx1:indx2]
-            precip_for_yr = pettmp_precip[indx1:indx2]
-
-        pet = thornthwaite(temp_mean, lat, year)
-
-        # convert precipitation with units: kg m-2 s-1 to mm per month
-        # ============================================================
-        precips = []
-        for imnth, precip in enumerate(precip_for_yr):
-            ndays = monthrange(year, imnth + 1)[1]
-            precip_mm = precip * numSecsDay * ndays
-            precips.append(precip_mm)
-
-        # TODO: do something about occasional runtime warning...
-        pot_evapotrans = [round(p, 2) for p in pet]
-        precip_out     = [round(p, 2) for p in precips]
-        tmean_out      = [round(t, 2) for t in temp_mean]
-
-        # write file
-        # ==========
-        output = []
-        for tstep, mean_temp in enumerate(tmean_out):
-            output.append([tstep+1, precip_out[tstep], pot_evapotrans[tstep], mean_temp])
-
-        with open(met_path, 'w', newline='') as fpout:
-            writer = csv_writer(fpout, delimiter='\t')
-            writer.writerows(output)
-
-        indx1 += MNTHS_YR
+        write_met_file(met_path, met_values[iyear])
 
     return met_fnames
 
+def _read_block(nc_var, time_slice, nrth_indx, east_indx):
+    """
+    read a hyperslab as a contiguous float32 array
+    masked values become NaN, as did float() of a masked value, so that gaps remain visible in the met files
+    """
+    return ascontiguousarray(filled(nc_var[time_slice, nrth_indx, east_indx].astype(float32), nan), dtype=float32)
+
+def _read_monthly_block(climgen, nc_dset, var_name, mnth_strt, mnth_stop, nrth_slice, east_slice):
+    """
+    monthly values for a block; daily datasets are aggregated to monthly means as they are streamed
+    """
+    nc_var = nc_dset[var_name]
+    if climgen.mnthly_flag:
+        return _read_block(nc_var, slice(mnth_strt, mnth_stop), nrth_slice, east_slice)
+
+    return aggregate_daily_to_monthly(nc_var, fetch_month_bounds(nc_dset), mnth_strt, mnth_stop, nrth_slice, east_slice)
+
+def _fetch_time_groups(climgen, nc_var, mnth_strt, mnth_stop, block_cells):
+    """
+    divide months mnth_strt to mnth_stop - 1 into groups whose slab for a block of block_cells cells fits within
+    MAX_SLAB_MB; for monthly datasets groups comprise whole time chunks of the file
+    """
+    steps_per_mnth = 1 if climgen.mnthly_flag else 31
+    nmnths = max(1, (MAX_SLAB_MB*1024*1024) // (4*block_cells*steps_per_mnth))   # values are float32
+
+    chunking = nc_var.chunking()
+    if climgen.mnthly_flag and chunking != 'contiguous' and chunking is not None:
+        tchunk = chunking[0]
+        nmnths = max(tchunk, nmnths - nmnths % tchunk)
+    else:
+        tchunk = 1
+
+    groups = []
+    imnth = mnth_strt
+    while imnth < mnth_stop:
+        jmnth = min(mnth_stop, imnth - imnth % tchunk + nmnths)
+        groups.append((imnth, jmnth))
+        imnth = jmnth
+
+    return groups
+
+def _read_monthly_cells(climgen, nc_dset, var_name, mnth_strt, mnth_stop, nrth_slice, east_slice, iys, ixs):
+    """
+    monthly values of the cells at offsets iys, ixs within a block, as an array of months by cells
+    the block is read time-major, one slab per group of months, see _fetch_time_groups, and the cells are gathered
+    from each slab with fancy indexing; for monthly datasets each chunk of the block is therefore decompressed once
+    however large the chunk, whereas for daily datasets chunks which straddle two groups are read twice
+    """
+    block_cells = (nrth_slice.stop - nrth_slice.start)*(east_slice.stop - east_slice.start)
+    cells = empty((max(0, mnth_stop - mnth_strt), len(iys)), dtype=float32)
+
+    for imnth, jmnth in _fetch_time_groups(climgen, nc_dset[var_name], mnth_strt, mnth_stop, block_cells):
+        slab = _read_monthly_block(climgen, nc_dset, var_name, imnth, jmnth, nrth_slice, east_slice)
+        cells[imnth - mnth_strt:jmnth - mnth_strt] = slab[:, iys, ixs]
+
+    return cells
+
+def _fetch_num_months(climgen, nc_dset, var_name):
+    """
+    number of months in a monthly or daily dataset
+    """
+    if climgen.mnthly_flag:
+        return nc_dset[var_name].shape[0]
+
+    return len(fetch_month_bounds(nc_dset)) - 1
+
+def _fetch_lta_arrays(lta_nc_fname):
+    """
+    LTA grids are small so each variable is read into memory once per session
+    """
+    if lta_nc_fname not in _lta_arrays:
+        _lta_arrays[lta_nc_fname] = {metric: _read_block(fetch_nc_var(lta_nc_fname, metric), slice(None),
+                                                        slice(None), slice(None)) for metric in METRICS_LTA}
+
+    return _lta_arrays[lta_nc_fname]
+
+def _gather_ltas(lta_nc_fname, indx_nrths, indx_easts):
+    """
+    LTAs for all cells with fancy indexing, an array of cells by months for each metric
+    precipitation and temperature are rounded as required by the input.txt file
+    """
+    lta_arrays = _fetch_lta_arrays(lta_nc_fname)
+
+    ltas = {}
+    for metric in METRICS_LTA:
+        ltas[metric] = ascontiguousarray(lta_arrays[metric][:, indx_nrths, indx_easts].T)
+        if metric in LTA_DECIMALS:
+            ltas[metric] = ltas[metric].astype(float64).round(LTA_DECIMALS[metric])
+
+    return ltas
+
+def _fetch_chunk_side(nc_var):
+    """
+    return the northing and easting sides, in grid cells, of the spatial chunks of a time, y, x variable
+    an unchunked variable is treated as having chunks of MAX_BLOCK_SIDE a side
+    """
+    chunking = nc_var.chunking()
+    if chunking == 'contiguous' or chunking is None:
+        return MAX_BLOCK_SIDE, MAX_BLOCK_SIDE
+
+    return chunking[-2], chunking[-1]
+
+def _fetch_block_side(nc_var):
+    """
+    return the northing and easting sides, in grid cells, of the tiles used for spatial simulations
+    tiles are aligned with the spatial chunks of the file but are at most MAX_BLOCK_SIDE a side
+    """
+    side_nrth, side_east = _fetch_chunk_side(nc_var)
+
+    return min(side_nrth, MAX_BLOCK_SIDE), min(side_east, MAX_BLOCK_SIDE)
+
+def fetch_spatial_tiles(climgen, valid_land, nrth_lo, nrth_hi, east_lo, east_hi):
+    """
+    divide an index rectangle of the weather grid, limits inclusive, into tiles each of which lies within one of the
+    blocks used to read weather, see _plan_block_reads; tiles without valid cells are omitted
+    where chunks exceed MAX_BLOCK_SIDE a side, a chunk spans several tiles and is read once for each
+    returns a list of northing and easting index slices
+    """
+    side_nrth, side_east = _fetch_block_side(climgen.hist_precip_dset['precip'])
+    nrows, ncols = valid_land.valid.shape
+    nrth_lo, nrth_hi = max(0, nrth_lo), min(nrows - 1, nrth_hi)
+    east_lo, east_hi = max(0, east_lo), min(ncols - 1, east_hi)
+
+    tiles = []
+    for tile_nrth in range(nrth_lo - nrth_lo % side_nrth, nrth_hi + 1, side_nrth):
+        nrth_slice = slice(max(tile_nrth, nrth_lo), min(tile_nrth + side_nrth, nrth_hi + 1))
+        for tile_east in range(east_lo - east_lo % side_east, east_hi + 1, side_east):
+            east_slice = slice(max(tile_east, east_lo), min(tile_east + side_east, east_hi + 1))
+            if valid_land.valid[nrth_slice, east_slice].any():
+                tiles.append((nrth_slice, east_slice))
+
+    return tiles
+
+def _plan_block_reads(nc_var, cell_indices):
+    """
+    group requested cells into rectangular blocks using the same index arithmetic as fetch_chess_bbox_indices
+    cell_indices is a dictionary of (indx_nrth, indx_east) keyed by grid_ref
+    returns a list of blocks, each comprising nrth and east index limits (inclusive) and the block's grid_refs
+    blocks coincide with the spatial chunks of the file, however large, since blocks are read in time slabs, see
+    _read_monthly_cells; blocks, and cells within blocks, are ordered to follow the chunk layout of the file
+    """
+    side_nrth, side_east = _fetch_chunk_side(nc_var)
+
+    tiles = {}
+    for grid_ref, (indx_nrth, indx_east) in cell_indices.items():
+        tile_key = (floor(indx_nrth / side_nrth), floor(indx_east / side_east))
+        if tile_key not in tiles:
+            tiles[tile_key] = []
+        tiles[tile_key].append((indx_nrth, indx_east, grid_ref))
+
+    blocks = []
+    for tile_key in sorted(tiles.keys()):
+        cells = sorted(tiles[tile_key])
+        nrths = [cell[0] for cell in cells]
+        easts = [cell[1] for cell in cells]
+        grid_refs = [cell[2] for cell in cells]
+        blocks.append([min(nrths), max(nrths), min(easts), max(easts), grid_refs])
+
+    return blocks
+
+def _fetch_first_year(nc_dset):
+    """
+    year of the first time step of a dataset, None if this cannot be determined
+    """
+    if 'time' not in nc_dset.variables:
+        return None
+
+    time_var = nc_dset.variables['time']
+    calendar = time_var.calendar if 'calendar' in time_var.ncattrs() else 'standard'
+    try:
+        first_date = num2date(time_var[0], time_var.units, calendar)
+    except (AttributeError, ValueError) as err:
+        print(ERROR_STR + 'could not determine first year of dataset: ' + str(err))
+        return None
+
+    return first_date.year
+
+def _fetch_time_window(climgen):
+    """
+    exact start and stop month indices of the historic and future datasets needed for the simulation years
+    historic data begins at hist_start_year, less the last month, and is followed by future data from fut_strt_indx
+    for daily datasets fut_strt_indx is a daily time index and is converted to the index of its month
+    """
+    nmnths = climgen.max_num_years*MNTHS_YR
+
+    hist_first_year = _fetch_first_year(climgen.hist_precip_dset)
+    if hist_first_year is None:
+        hist_strt = 0
+    else:
+        hist_strt = max(0, (climgen.hist_start_year - hist_first_year)*MNTHS_YR)
+
+    nhist = _fetch_num_months(climgen, climgen.hist_precip_dset, 'precip') - 1     # discard last month of historic data
+    hist_stop = max(hist_strt, min(hist_strt + nmnths, nhist))
+
+    if climgen.mnthly_flag:
+        fut_strt = climgen.fut_strt_indx
+    else:
+        fut_strt = fetch_month_indx(fetch_month_bounds(climgen.fut_precip_dset), climgen.fut_strt_indx)
+    nfut = _fetch_num_months(climgen, climgen.fut_precip_dset, 'pr')
+    fut_stop = max(fut_strt, min(fut_strt + nmnths - (hist_stop - hist_strt), nfut))
+
+    return hist_strt, hist_stop, fut_strt, fut_stop
+
+def _make_wthr_cache_key(climgen, grid_ref):
+    """
+    key for weather cache comprising identities of the four CHESS files, scenario, realisation and time window
+    """
+    if not hasattr(climgen, 'wthr_dset_ids'):
+        climgen.wthr_dset_ids = [fetch_file_identity(getattr(climgen, attrib + '_fname'))
+                                                    for attrib in ['hist_precip', 'hist_tas', 'fut_precip', 'fut_tas']]
+
+    return WthrCellCache.make_key(climgen.wthr_dset_ids, climgen.fut_clim_scen, climgen.realis,
+                                                                                    climgen.wthr_wndw, grid_ref)
+
 def add_data_to_grid_cells(climgen, grid_cells):
     """
     units are taken care of when outputting met files in make_met_file
@@ -122,89 +315,138 @@ def add_data_to_grid_cells(climgen, grid_cells):
         tas in degrees Kelvin
 
     due to an anomoly in the historic dataset we must reduce number of time steps from by one month
-    """
 
+    only the time window required by the simulation is read, see _fetch_time_window
+    weather is read one block of cells at a time, see _plan_block_reads, rather than one cell at a time
+    """
     wthr_rsrc = climgen.wthr_rsrc_key
     hist_precip_dset = climgen.hist_precip_dset
     fut_precip_dset = climgen.fut_precip_dset
     hist_tas_dset = climgen.hist_tas_dset
     fut_tas_dset = climgen.fut_tas_dset
-    fut_strt_indx = climgen.fut_strt_indx
-
-    for grid_ref in grid_cells.keys():
-        print('Adding CHESS data to cell '  + grid_ref)
-        QApplication.processEvents()
+    wthr_cache = climgen.wthr_cache
 
-        grid_cell = copy(grid_cells[grid_ref])
-        indx_east = grid_cell.indx_east
-        indx_nrth = grid_cell.indx_nrth
+    # read only those time steps required by the simulation
+    # =====================================================
+    hist_strt, hist_stop, fut_strt, fut_stop = _fetch_time_window(climgen)
+    climgen.wthr_wndw = (hist_strt, hist_stop, fut_strt, fut_stop)
 
-        # record LTAs
-        # ===========
-        for metric in METRICS_LTA:  # tas, pet, precip
-            grid_cell.lta[metric] = [float(val) for val in climgen.lta_nc_dset.variables[metric][:, indx_nrth, indx_east]]
+    # gather LTAs for all cells in one go, these are held as columns of the GridCellSet
+    # ================================================================================
+    grid_cells.lta = _gather_ltas(climgen.lta_nc_fname, grid_cells.indx_nrth, grid_cells.indx_east)
 
-        # check if a complete set of met files for this grid cell already exists
-        # ======================================================================
-        lat = grid_cell.lat
-        met_rel_path = '..\\..\\' + wthr_rsrc + '\\' + grid_ref + '\\'
-        grid_cell.met_rel_path = met_rel_path
+    # identify those cells which lack a complete set of met files
+    # ===========================================================
+    cells_to_read = {}
+    for grid_ref, indx_nrth, indx_east, lat in zip(grid_cells.keys(), grid_cells.indx_nrth.tolist(),
+                                                    grid_cells.indx_east.tolist(), grid_cells.lat.tolist()):
 
-        clim_dir = normpath(join(climgen.sims_dir, wthr_rsrc, grid_ref))      #
+        clim_dir = normpath(join(climgen.sims_dir, wthr_rsrc, grid_ref))
         met_fnames = _make_met_files_osgb(clim_dir, lat, climgen)     # check to see if met files are aleady present
         if len(met_fnames) == 0:
 
-            # discard last month of historic data
-            # ===================================
-            wthr = {}
-            hist_vals = [float(val) for val in hist_precip_dset['precip'][:-1, indx_nrth, indx_east]]
-            fut_vals  = [float(val) for val in fut_precip_dset['pr'][fut_strt_indx:, indx_nrth, indx_east]]
-            wthr['precip'] = hist_vals + fut_vals
+            # use weather series previously extracted for this cell if available
+            # ===================================================================
+            wthr = wthr_cache.get(_make_wthr_cache_key(climgen, grid_ref))
+            if wthr is None:
+                cells_to_read[grid_ref] = (indx_nrth, indx_east)
+            else:
+                met_fnames = _make_met_files_osgb(clim_dir, lat, climgen, wthr)
+
+    grid_cells.met_rel_path[:] = ['..\\..\\' + wthr_rsrc + '\\' + grid_ref + '\\' for grid_ref in grid_cells.keys()]
+
+    # read weather for each block of cells, gathering the cells from each time slab of each dataset
+    # ==============================================================================================
+    blocks = _plan_block_reads(hist_precip_dset['precip'], cells_to_read)
+    for nrth_lo, nrth_hi, east_lo, east_hi, grid_refs in blocks:
+        print('Adding CHESS data to {} cells in block with northing indices {} to {}, easting indices {} to {}'
+                                            .format(len(grid_refs), nrth_lo, nrth_hi, east_lo, east_hi))
+        QApplication.processEvents()
+
+        nrth_slice = slice(nrth_lo, nrth_hi + 1)
+        east_slice = slice(east_lo, east_hi + 1)
+        irows = asarray([grid_cells.positions()[grid_ref] for grid_ref in grid_refs], dtype=int64)
+        iys = grid_cells.indx_nrth[irows] - nrth_lo
+        ixs = grid_cells.indx_east[irows] - east_lo
 
-            hist_vals = [float(val) for val in hist_tas_dset['tas'][:-1, indx_nrth, indx_east]]
-            fut_vals = [float(val) for val in fut_tas_dset['tas'][fut_strt_indx:, indx_nrth, indx_east]]
-            wthr['tas'] = hist_vals + fut_vals
+        block_args = (nrth_slice, east_slice, iys, ixs)
+        hist_precip = _read_monthly_cells(climgen, hist_precip_dset, 'precip', hist_strt, hist_stop, *block_args)
+        fut_precip = _read_monthly_cells(climgen, fut_precip_dset, 'pr', fut_strt, fut_stop, *block_args)
+        hist_tas = _read_monthly_cells(climgen, hist_tas_dset, 'tas', hist_strt, hist_stop, *block_args)
+        fut_tas = _read_monthly_cells(climgen, fut_tas_dset, 'tas', fut_strt, fut_stop, *block_args)
 
-            met_fnames = _make_met_files_osgb(clim_dir, lat, climgen, wthr)
+        # arrays of cells by months
+        # =========================
+        precip = ascontiguousarray(concatenate((hist_precip, fut_precip)).T)
+        tas = ascontiguousarray(concatenate((hist_tas, fut_tas)).T)
+
+        for icell, grid_ref in enumerate(grid_refs):
+            wthr = {'precip': precip[icell], 'tas': tas[icell]}
+
+            nmissing = int(isnan(wthr['precip']).sum() + isnan(wthr['tas']).sum())
+            if nmissing > 0:
+                print(WARN_STR + 'cell {} lacks {} monthly weather values which will be written as nan'
+                                                                                        .format(grid_ref, nmissing))
+
+            wthr_cache.put(_make_wthr_cache_key(climgen, grid_ref), wthr)
             # grid_cell.wthr = wthr
 
-        grid_cells[grid_ref] = grid_cell
+        # PET and precipitation for all cells and years of the block in one go
+        # ====================================================================
+        precips, pets, temp_means = fetch_met_arrays(precip, tas, grid_cells.lat[irows], climgen.hist_start_year)
+
+        for icell, grid_ref in enumerate(grid_refs):
+            clim_dir = normpath(join(climgen.sims_dir, wthr_rsrc, grid_ref))
+            if not lexists(clim_dir):
+                makedirs(clim_dir)
+
+            met_fnames = _write_met_files(clim_dir, climgen, precips[icell], pets[icell], temp_means[icell])
+
+        del hist_precip, fut_precip, hist_tas, fut_tas, precip, tas
+
+    wthr_cache.flush()
 
     return
 
 def open_chess_dsets(climgen):
     """
-
+    cell-major copies of the CHESS files, see rechunk_chess_fns.py, are used in preference if present
+    datasets are taken from the pool of open datasets, see nc_dset_pool.py
     """
-    climgen.fut_precip_dset = Dataset(climgen.fut_precip_fname, 'r')
-    climgen.fut_tas_dset = Dataset(climgen.fut_tas_fname, 'r')
-    climgen.hist_precip_dset = Dataset(climgen.hist_precip_fname, 'r')
-    climgen.hist_tas_dset = Dataset(climgen.hist_tas_fname, 'r')
-    climgen.lta_nc_dset = Dataset(climgen.lta_nc_fname, 'r')
+    store_dir = join(climgen.cache_dir, CELL_MAJOR_DIR)
+    for attrib in ['fut_precip', 'fut_tas', 'hist_precip', 'hist_tas']:
+        nc_fname = fetch_cell_major_fname(store_dir, getattr(climgen, attrib + '_fname'))
+        if nc_fname != getattr(climgen, attrib + '_fname'):
+            print('Using cell-major file ' + nc_fname)
+        setattr(climgen, attrib + '_dset', fetch_nc_dset(nc_fname))
+
+    climgen.lta_nc_dset = fetch_nc_dset(climgen.lta_nc_fname)
 
     return
 
 def close_chess_dsets(climgen):
     """
-
+    datasets remain open in the pool for subsequent studies until released by evict_nc_dsets
     """
-    climgen.fut_precip_dset.close()
-    climgen.fut_tas_dset.close()
-    climgen.hist_precip_dset.close()
-    climgen.hist_tas_dset.close()
-    climgen.lta_nc_dset.close()
+    climgen.fut_precip_dset = None
+    climgen.fut_tas_dset = None
+    climgen.hist_precip_dset = None
+    climgen.hist_tas_dset = None
+    climgen.lta_nc_dset = None
 
     return
 
 def fetch_chess_bbox_indices(lon_ll, lat_ll, lon_ur, lat_ur):
     """
-     use Hannah Fry functions
+     both corners are converted in one call
     """
-    eastng_ll, nrthng_ll = WGS84toOSGB36(lon_ll, lat_ll)
+    eastngs, nrthngs = wgs84_to_osgb36([lon_ll, lon_ur], [lat_ll, lat_ur])
+    eastng_ll, eastng_ur = eastngs.tolist()
+    nrthng_ll, nrthng_ur = nrthngs.tolist()
+
     indx_east_ll = floor(eastng_ll / 1000)
     indx_nrth_ll = floor(nrthng_ll / 1000)
 
-    eastng_ur, nrthng_ur = WGS84toOSGB36(lon_ur, lat_ur)
     indx_east_ur = ceil(eastng_ur / 1000)
     indx_nrth_ur = ceil(nrthng_ur / 1000)
 
@@ -14,22 +14,33 @@ __author__ = 'mmartin'
 #
 from PyQt5.QtWidgets import QApplication
 from time import time
-from os.path import isfile
+from os.path import isfile, normpath
 from locale import setlocale, LC_ALL, format_string
-from random import randint
 from csv import reader, Sniffer
-from pandas import read_csv
-from netCDF4 import Dataset
+from pandas import read_csv, Index
+from numpy import (asarray, float64, int64, unique, full, isnan, isfinite, where, flatnonzero, arange, bincount,
+                                    floor, argsort, minimum, hypot, inf, nan, concatenate, empty, nonzero, isin)
+from numpy.random import default_rng, SeedSequence
 
-from cvrtcoord import WGS84toOSGB36, OSGB36toWGS84
+from osgb_coord_fns import wgs84_to_osgb36, lattice_to_wgs84
 from misc_lta_fns import write_coords_check_file
+from chess_valid_land_fns import ChessValidLand
+from land_use_mask_fns import LandUseMask
 
-METRICS = ['precip', 'tas']
+GRID_CELL_COLUMNS = {'morecs_id': object, 'easting': 'int64', 'nrthing': 'int64', 'grid_ref': object,
+                     'indx_east': 'int64', 'indx_nrth': 'int64', 'lon': 'float64', 'lat': 'float64', 'site_code': object}
 
 setlocale(LC_ALL, '')
 sleepTime = 2
 NoData = -999.0
-numDaysToCheck  = 25   # validate this number of days before accepting a point
+CELL_KEY_FACTOR = 1000000    # cell indices are less than this
+MAX_NOT_FOUND_WARNINGS = 20
+CSV_COORD_COLUMNS = [['BNG_X', 'BNG_Y'], ['lon', 'lat']]   # sites are located by either pair
+CSV_DTYPES = {'BNG_X': 'float32', 'BNG_Y': 'float32', 'lon': 'float64', 'lat': 'float64', 'site_code': 'str'}
+SNAP_RINGS = 2         # rings of neighbouring cells searched for sites whose cell is not in the crop calendar
+CSV_CHUNK_ROWS = 100000
+RNDM_BATCH_MARGIN = 1.25   # oversample random candidates to allow for cells with no data
+RNDM_BATCH_MIN = 64
 
 CSV_FILE = 2
 MORECS_DFLT = 1  # TODO
@@ -55,16 +66,26 @@ def generate_osgb_sites(form, run_id):
 
     metric = 'precip'
     nc_fname = form.wthr_sets['CHESS_historic']['ds_' + metric]
-    nc_dset = Dataset(nc_fname)
+    valid_land = fetch_valid_land(form, nc_fname, metric)
 
+    land_use_mask = fetch_land_use_mask(form, valid_land)
     if run_id == CSV_FILE:
-        grid_cells = fetch_cells_from_csv(form, nc_dset.variables, metric, csv_coords_fn)
+        grid_cells = fetch_cells_from_csv(form, valid_land, csv_coords_fn)
         if grid_cells is None:
             print('No grid cells returned from ' + csv_coords_fn)
-    else:
-        grid_cells = fetch_random_cells(form, nc_dset.variables, metric, num_cells)
 
-    nc_dset.close()
+        # drop sites excluded by the land use mask before any weather or soil data is read
+        # =================================================================================
+        elif land_use_mask is not None:
+            retain_flags = land_use_mask.retain[grid_cells.indx_nrth, grid_cells.indx_east]
+            mess = 'Land use mask retained {} cells and dropped {}'.format(int(retain_flags.sum()),
+                                                                                    int((~retain_flags).sum()))
+            form.lgr.info(mess); print(mess)
+            grid_cells = grid_cells.take(flatnonzero(retain_flags))
+    else:
+        # masked cells are rejected and replaced during selection, see _sample_valid_rows
+        # ================================================================================
+        grid_cells = fetch_random_cells(form, valid_land, num_cells, land_use_mask)
 
     if grid_cells is not None:
         nsites = len(grid_cells)
@@ -76,7 +97,110 @@ def generate_osgb_sites(form, run_id):
 
     return grid_cells
 
-def fetch_cells_from_csv(form, vars_wthr, metric, csv_fn):
+def fetch_valid_land(form, nc_fname, metric):
+    """
+    bitmap of cells with weather data is built once per dataset and retained for the session
+    """
+    if hasattr(form, 'chess_valid_land') and form.chess_valid_land.nc_fname == normpath(nc_fname):
+        return form.chess_valid_land
+
+    form.chess_valid_land = ChessValidLand(form.lgr, nc_fname, form.sttngs['cache_dir'], metric)
+
+    return form.chess_valid_land
+
+def fetch_land_use_mask(form, valid_land):
+    """
+    land use mask rasterised onto the weather grid once per session, or None if there is no mask
+    """
+    if form.mask_fn is None:
+        return None
+
+    if hasattr(form, 'land_use_mask') and form.land_use_mask.mask_fn == normpath(form.mask_fn):
+        return form.land_use_mask
+
+    try:
+        form.land_use_mask = LandUseMask(form.lgr, form.mask_fn, valid_land, form.sttngs['cache_dir'])
+    except (ValueError, OSError) as err:
+        print(ERROR_STR + 'could not apply land use mask: {}'.format(err))
+        return None
+
+    return form.land_use_mask
+
+def fetch_tile_cells(form, valid_land, nrth_slice, east_slice):
+    """
+    GridCellSet of the valid cells of a tile of the weather grid which have a record in the crop calendar, ordered by
+    northing then easting index; also returns the number of valid cells which lack a record
+    cells excluded by the land use mask, if any, are omitted
+    """
+    valid = valid_land.valid[nrth_slice, east_slice]
+    land_use_mask = fetch_land_use_mask(form, valid_land)
+    if land_use_mask is not None:
+        valid = valid & land_use_mask.retain[nrth_slice, east_slice]
+
+    indx_nrths, indx_easts = nonzero(valid)
+    indx_nrths += nrth_slice.start
+    indx_easts += east_slice.start
+
+    geometry = (valid_land.gridsize, valid_land.min_easting, valid_land.min_nrthing)
+    eastings = valid_land.min_easting + (indx_easts + 0.5)*valid_land.gridsize
+    nrthings = valid_land.min_nrthing + (indx_nrths + 0.5)*valid_land.gridsize
+    grid_refs, cell_eastings, cell_nrthings, found_flags, dummy = \
+                                        form.crop_grid.resolve_cells(eastings, nrthings, geometry, snap_rings = 0)
+
+    irows = flatnonzero(found_flags)
+    lons, lats = lattice_to_wgs84(cell_eastings[irows], cell_nrthings[irows])
+    grid_cells = GridCellSet([{'morecs_id': full(len(irows), MORECS_DFLT, dtype=object),
+                    'easting': cell_eastings[irows], 'nrthing': cell_nrthings[irows], 'grid_ref': grid_refs[irows],
+                    'indx_east': indx_easts[irows], 'indx_nrth': indx_nrths[irows], 'lon': lons, 'lat': lats,
+                    'site_code': grid_refs[irows]}])
+
+    return grid_cells, len(found_flags) - len(irows)
+
+def _stream_cells_from_csv(form, valid_land, csv_fn, delim, coord_cols, counts):
+    """
+    read the site file in chunks of CSV_CHUNK_ROWS rows comprising only the required columns with compact dtypes
+    each chunk is resolved against the 1 km grid and validated vectorised, then the columns of its valid cells are
+    yielded, see GridCellSet
+    counts of sites read and rejected are accumulated in counts
+    """
+    geometry = (valid_land.gridsize, valid_land.min_easting, valid_land.min_nrthing)
+    usecols = coord_cols + ['site_code']
+    for chunk in read_csv(csv_fn, sep = delim, usecols = usecols, dtype = CSV_DTYPES, chunksize = CSV_CHUNK_ROWS):
+        QApplication.processEvents()
+        if coord_cols == ['lon', 'lat']:
+            eastings, nrthings = wgs84_to_osgb36(chunk['lon'].values, chunk['lat'].values)
+        else:
+            eastings = chunk['BNG_X'].values
+            nrthings = chunk['BNG_Y'].values
+        site_codes = chunk['site_code'].values
+        counts['read'] += len(chunk)
+
+        # snap sites to the containing cell of the 1 km grid, or the nearest cell in the crop calendar
+        # ===========================================================================================
+        grid_refs, cell_eastings, cell_nrthings, found_flags, snapped_flags = \
+                                                        form.crop_grid.resolve_cells(eastings, nrthings, geometry)
+        no_east_flags = isnan(eastings) | isnan(nrthings)
+        counts['no_east'] += int(no_east_flags.sum())
+        counts['snapped'] += int(snapped_flags.sum())
+
+        for irow in flatnonzero(~found_flags & ~no_east_flags):
+            counts['not_found'] += 1
+            if counts['not_found'] <= MAX_NOT_FOUND_WARNINGS:
+                print(WARN_STR + 'Easting {} and Northing: {} not found in OSGB lookup file'
+                                                                            .format(eastings[irow], nrthings[irow]))
+
+        # validate chunk in one go
+        # ========================
+        valid_flags, indx_easts, indx_nrths = valid_land.check_cells(cell_eastings, cell_nrthings)
+        counts['no_data'] += int((found_flags & ~valid_flags).sum())
+
+        irows = flatnonzero(found_flags & valid_flags)
+        lons, lats = lattice_to_wgs84(cell_eastings[irows], cell_nrthings[irows])
+        yield {'morecs_id': full(len(irows), MORECS_DFLT, dtype=object), 'easting': cell_eastings[irows],
+               'nrthing': cell_nrthings[irows], 'grid_ref': grid_refs[irows], 'indx_east': indx_easts[irows],
+               'indx_nrth': indx_nrths[irows], 'lon': lons, 'lat': lats, 'site_code': site_codes[irows]}
+
+def fetch_cells_from_csv(form, valid_land, csv_fn):
     """
     read and validate CSV file of weather
     could use Multiple Char Separator in read_csv in Pandas
@@ -84,6 +208,8 @@ def fetch_cells_from_csv(form, vars_wthr, metric, csv_fn):
 
     Met Office Rainfall and Evapo-transpiration Calculation System (MORECS) – for modelling soil moisture and runoff
                             see: https://www.metoffice.gov.uk/services/business-industry/agriculture
+
+    the file is streamed in chunks so that memory use does not depend on the size of the file
     """
     func_name =  __prog__ + '  fetch_cells_from_csv'
 
@@ -92,159 +218,228 @@ def fetch_cells_from_csv(form, vars_wthr, metric, csv_fn):
         dialect = Sniffer().sniff(fobj.readline(), [',','\t'])
     delim = dialect.delimiter  # "delimiter" is a 1-character string
 
-    # columns are: MORECS_ID,Grid_Easting,Grid_Northing,PLAN_NO_1km_ID
-    # ================================================================
-    coords = {'site_code': [], 'easting': [], 'nrthing': [], 'grid_ref': []}
-    csv_df = read_csv(csv_fn, sep = delim)
-    if 'BNG_X' not in csv_df.columns or 'BNG_Y' not in csv_df.columns:
-        print(ERROR_STR + 'Invalid CSV file ' + csv_fn + ' - columns BNG_X and BNG_Y must be present')
-        return None
-
-    coords['easting'] = list(csv_df['BNG_X'])
-    coords['nrthing'] = list(csv_df['BNG_Y'])
-    coords['site_code'] = list(csv_df['site_code'])
+    # columns are: BNG_X,BNG_Y,site_code or lon,lat,site_code
+    # ========================================================
+    columns = read_csv(csv_fn, sep = delim, nrows = 0).columns
+    coord_cols = None
+    for coord_pair in CSV_COORD_COLUMNS:
+        if coord_pair[0] in columns and coord_pair[1] in columns:
+            coord_cols = coord_pair
+            break
 
-    ncrds_read = len(coords['easting'])
-    if ncrds_read == 0:
+    if coord_cols is None or 'site_code' not in columns:
+        print(ERROR_STR + 'Invalid CSV file ' + csv_fn + ' - columns BNG_X, BNG_Y or lon, lat and site_code must be present')
         return None
 
-    coords['grid_ref'] = ncrds_read*[None]
-
-    # =====================
-    osgb_df = form.crop_grid.df
-    grid_cells = {}
-    nvalid_cells = 0
-    duplics_list = []
-    not_found_cells = 0
-    no_east_cells = 0
-    nbad_cells = 0
+    column_chunks = []
+    nvalid_sites = 0
+    counts = {'read': 0, 'not_found': 0, 'no_east': 0, 'no_data': 0, 'snapped': 0}
     last_time = time()
-    for site_code, easting, nrthing, grid_ref in zip(coords['site_code'], coords['easting'], coords['nrthing'], coords['grid_ref']):
-        QApplication.processEvents()
-        res = osgb_df.loc[(osgb_df['Grid_Easting'] == easting) & (osgb_df['Grid_Northing'] == nrthing)]
-        if len(res) > 0:
-            grid_ref = res['PLAN_NO_1km_ID'].values[0]
-        else:
-            print(WARN_STR + 'Easting {} and Northing: {} not found in OSGB lookup file'.format(easting, nrthing))
-            not_found_cells += 1
-            continue
-
-        grid_cell = GridCell([MORECS_DFLT, easting, nrthing, grid_ref])
-        if grid_cell.easting is None:
-            no_east_cells += 1
-            continue
-
-        return_flag, grid_ref = check_grid_cell(form.lgr, vars_wthr, metric, site_code, grid_cell)
-        if return_flag:
-            if grid_ref in grid_cells:
-                duplics_list.append([site_code, grid_ref, easting, nrthing, grid_cells[grid_ref].site_code])
-            else:
-                grid_cells[grid_ref] = grid_cell
-                nvalid_cells += 1
-        else:
-            nbad_cells += 1
+    for chunk_columns in _stream_cells_from_csv(form, valid_land, csv_fn, delim, coord_cols, counts):
+        column_chunks.append(chunk_columns)
+        nvalid_sites += len(chunk_columns['grid_ref'])
 
         new_time = time()
         if new_time - last_time > sleepTime:
             last_time = new_time
-            print('\rNumber of valid cells: {}\trejected: {}'.format(nvalid_cells, nbad_cells))
+            print('\rSites read: {}\tnumber of valid sites: {}'.format(counts['read'], nvalid_sites))
+
+    if counts['read'] == 0:
+        return None
+
+    # where sites share a cell the first is retained
+    # ===============================================
+    all_cells = GridCellSet(column_chunks)
+    dummy, first_rows = unique(all_cells.grid_ref.astype(str), return_index = True)
+    first_rows.sort()
+    nduplics = len(all_cells) - len(first_rows)
+    grid_cells = all_cells.take(first_rows)
+
+    if counts['not_found'] > MAX_NOT_FOUND_WARNINGS:
+        print(WARN_STR + '{} sites not found in OSGB lookup file'.format(counts['not_found']))
 
     # report progress and exit
     # ========================
-    mess =('Retrieved {} valid cells\t{} no data\t{} not found\t{} no easting\t{} duplicates'
-                                .format(nvalid_cells, nbad_cells, not_found_cells, no_east_cells, len(duplics_list)))
+    mess =('Retrieved {} valid cells\t{} no data\t{} not found\t{} no easting\t{} duplicates\t{} snapped to a neighbour'
+                .format(len(grid_cells), counts['no_data'], counts['not_found'], counts['no_east'], nduplics,
+                                                                                                counts['snapped']))
     form.lgr.info(mess + 'in function ' + func_name)
     print('\n' + mess)
 
     return grid_cells
 
-def fetch_random_cells(form, vars_wthr, metric, nrequested_cells):
+def fetch_random_cells(form, valid_land, nrequested_cells, land_use_mask = None):
     """
-
+    select distinct cells at random from the 1 km grid using a seeded generator so that selections can be repeated
+    optionally the requested number is shared between MORECS regions in proportion to their number of cells, the
+    shortfall of regions with too few valid cells is then made up from regions with spare cells
+    cells excluded by the land use mask, if given, are rejected like cells with no data
     """
     func_name =  __prog__ + '  fetch_random_cells'
 
-    grid_cells = {}
+    seed = form.sttngs['rndm_seed']
+    if seed is None:
+        seed = int(SeedSequence().entropy % 2**32)
+    rng = default_rng(seed)
+    mess = 'Random selection of cells uses seed {}'.format(seed)
+    form.lgr.info(mess); print(mess)
+
+    # coordinate columns are extracted once
+    # =====================================
+    df = form.crop_grid.df
+    morecs_ids = df.iloc[:, 0].values
+    eastings = df['Grid_Easting'].values
+    nrthings = df['Grid_Northing'].values
+    grid_refs = df['PLAN_NO_1km_ID'].values
+    crop_cols = (morecs_ids, eastings, nrthings, grid_refs)
+
+    stratify_flag = form.sttngs['rndm_stratify']
+    if stratify_flag:
+        regions, region_indices = unique(morecs_ids, return_inverse = True)
+        quotas = _apportion_cells(bincount(region_indices), nrequested_cells)
+        strata = [(flatnonzero(region_indices == iregion), quota) for iregion, quota in enumerate(quotas)]
+    else:
+        strata = [(arange(form.crop_grid.nlines), nrequested_cells)]
+
+    retain = None if land_use_mask is None else land_use_mask.retain
+
+    column_chunks = []
+    selected = set()
+    spare_rows = []
     nvalid_cells = 0
     nbad_cells = 0
-    last_time = time()
-    while nvalid_cells < nrequested_cells:
-        irec = randint(0, form.crop_grid.nlines)
-        grid_cell = GridCell(form.crop_grid.df.values[irec])
-        site_code = 'RND' + '{:0=3d}'.format(nvalid_cells + 1)
-        return_flag, grid_ref = check_grid_cell(form.lgr, vars_wthr, metric, site_code, grid_cell)
-        if return_flag:
-            grid_cells[grid_ref] = grid_cell
-            nvalid_cells += 1
-        else:
-            nbad_cells += 1
-
-        new_time = time()
-        if new_time - last_time > sleepTime:
-            last_time = new_time
-            print('\rNumber of valid cells: {}\trejected: {}'.format(nvalid_cells, nbad_cells))
-            QApplication.processEvents()
+    for row_indices, quota in strata:
+        if quota > 0:
+            column_chunk, nrejected = _select_stratum(rng, row_indices, quota, crop_cols, valid_land, retain,
+                                                                                            selected, nvalid_cells)
+            column_chunks.append(column_chunk)
+            nbad_cells += nrejected
+            nselected = len(column_chunk['grid_ref'])
+            nvalid_cells += nselected
+            if nselected < quota:
+                if stratify_flag:
+                    print(WARN_STR + 'only {} of {} cells available in MORECS region {}'
+                                                        .format(nselected, quota, morecs_ids[row_indices[0]]))
+                continue
+
+        spare_rows.append(row_indices)      # region may have further valid cells
+
+    # pass the shortfall of regions lacking valid cells on to regions with spare cells
+    # ================================================================================
+    nshort = nrequested_cells - nvalid_cells
+    if stratify_flag and nshort > 0 and len(spare_rows) > 0:
+        row_indices = concatenate(spare_rows)
+        row_indices = row_indices[~isin(grid_refs[row_indices], list(selected))]
+        column_chunk, nrejected = _select_stratum(rng, row_indices, nshort, crop_cols, valid_land, retain,
+                                                                                            selected, nvalid_cells)
+        column_chunks.append(column_chunk)
+        nbad_cells += nrejected
+        nvalid_cells += len(column_chunk['grid_ref'])
+
+        mess = 'Shortfall of {} cells was made up with {} cells from regions with spare cells'.format(nshort,
+                                                                                    len(column_chunk['grid_ref']))
+        form.lgr.info(mess); print(mess)
+
+    if nvalid_cells < nrequested_cells:
+        print(WARN_STR + 'only {} of {} requested cells available'.format(nvalid_cells, nrequested_cells))
+
+    grid_cells = GridCellSet(column_chunks)
 
     # report progress and exit
     # ========================
-    mess =('Retrieved {} randomly selected cells\trejected {} cells with no data'.format(nvalid_cells, nbad_cells))
+    rejected = 'no data' if retain is None else 'no data or excluded by the land use mask'
+    mess =('Retrieved {} randomly selected cells\trejected {} cells with {}'.format(nvalid_cells, nbad_cells, rejected))
     form.lgr.info(mess + 'in function ' + func_name)
     print('\n' + mess)
     QApplication.processEvents()
 
     return grid_cells
 
-def check_grid_cell(lggr, vars_wthr, metric, site_code, grid_cell):
-    '''
-    Check if looks like there is a complete set of data for this grid coordinate
-    '''
-    func_name = __prog__ +  ' check_nc_data'
-
-    # easting and northing size in metres
-    # ===================================
-    easting    = grid_cell.easting
-    nrthing   = grid_cell.nrthing
-    gridsize   = abs((vars_wthr['x'][0] - vars_wthr['x'][1]))
-    min_easting  = vars_wthr['x'][0] - (gridsize / 2.0)
-    min_nrthing = vars_wthr['y'][0] - (gridsize / 2.0)
-
-    # limit number of days to check to improve performance
-    # ====================================================
-    valid_flag = True
-    ix_indx = int((easting - min_easting)/gridsize)
-    iy_indx = int((nrthing - min_nrthing)/gridsize)
-
-    grid_cell.indx_east = ix_indx
-    grid_cell.indx_nrth = iy_indx
-
-    lon, lat = OSGB36toWGS84(easting, nrthing)
-    mess = '{} data for easting {}\t northing {}'.format(metric, easting, nrthing)
-    mess += '\tat lon {}\tlat {}\tfunction {}'.format(round(float(lon), 5), round(float(lat), 5), func_name)
-
-    grid_cell.lon = lon
-    grid_cell.lat = lat
-    grid_cell.site_code = site_code
-
-    val_list = []
-    for iday_indx in range(0, numDaysToCheck):
-        try:
-            val = vars_wthr[metric][iday_indx][iy_indx][ix_indx]
-        except (IndexError, RuntimeError) as err:
-            lggr.info(ERROR_STR + ' {}\tiday_indx {}\tiy_indx {}\tix_indx {}'.format(err, iday_indx, iy_indx, ix_indx))
-            valid_flag = False
-            break
+def _select_stratum(rng, row_indices, quota, crop_cols, valid_land, retain, selected, nvalid_cells):
+    """
+    columns of up to quota valid cells drawn at random from the given rows of the crop calendar, see GridCellSet,
+    and the number of cells rejected; site codes are numbered on from the number of cells already selected
+    """
+    morecs_ids, eastings, nrthings, grid_refs = crop_cols
+    irows, indx_easts, indx_nrths, nrejected = _sample_valid_rows(rng, row_indices, quota, eastings, nrthings,
+                                                                  valid_land, retain, grid_refs, selected)
+    irows = asarray(irows, dtype=int64)
+    lons, lats = lattice_to_wgs84(eastings[irows], nrthings[irows])
+    site_codes = ['RND' + '{:0=3d}'.format(nvalid_cells + icell + 1) for icell in range(len(irows))]
+    column_chunk = {'morecs_id': morecs_ids[irows], 'easting': eastings[irows], 'nrthing': nrthings[irows],
+                    'grid_ref': grid_refs[irows], 'indx_east': indx_easts, 'indx_nrth': indx_nrths,
+                    'lon': lons, 'lat': lats, 'site_code': site_codes}
+
+    return column_chunk, nrejected
+
+def _apportion_cells(region_sizes, nrequested_cells):
+    """
+    share requested cells between regions in proportion to their size using largest remainders
+    """
+    shares = region_sizes*nrequested_cells/region_sizes.sum()
+    quotas = floor(shares).astype(int64)
+    nshort = nrequested_cells - quotas.sum()
+    if nshort > 0:
+        quotas[argsort(quotas - shares, kind = 'stable')[:nshort]] += 1
 
-        if hasattr(val, '_mask'):
-            lggr.info('No ' + mess)
-            valid_flag = False
-            break
-        else:
-            val_list.append(val)
+    return minimum(quotas, region_sizes)
 
-    if valid_flag:
-        lggr.info('Good ' + mess)
+def _sample_valid_rows(rng, row_indices, nrequired, eastings, nrthings, valid_land, retain, grid_refs, selected):
+    """
+    rows are permuted once then validated in consecutive batches, sized to meet the shortfall, until nrequired valid
+    rows are found or rows are exhausted; permuting guarantees rows are distinct
+    rows outside the retain array of the land use mask, if not None, or whose grid_ref is in the set of those already
+    selected are rejected, the set is updated
+    """
+    shuffled = rng.permutation(row_indices)
+
+    accepted = []
+    accepted_easts = []
+    accepted_nrths = []
+    nrejected = 0
+    nxt = 0
+    last_time = time()
+    while len(accepted) < nrequired and nxt < len(shuffled):
+
+        # draw and validate a batch of candidates with a margin for rejections
+        # =====================================================================
+        nshort = nrequired - len(accepted)
+        batch = shuffled[nxt:nxt + int(nshort*RNDM_BATCH_MARGIN) + RNDM_BATCH_MIN]
+        nxt += len(batch)
+        valid_flags, indx_easts, indx_nrths = valid_land.check_cells(eastings[batch], nrthings[batch])
+        if retain is not None:
+            valid_flags[valid_flags] = retain[indx_nrths[valid_flags], indx_easts[valid_flags]]
+
+        for irow, valid_flag, indx_east, indx_nrth in zip(batch, valid_flags, indx_easts, indx_nrths):
+            if len(accepted) == nrequired:
+                break
+            if valid_flag and grid_refs[irow] not in selected:
+                selected.add(grid_refs[irow])
+                accepted.append(irow)
+                accepted_easts.append(indx_east)
+                accepted_nrths.append(indx_nrth)
+            else:
+                nrejected += 1
+
+        new_time = time()
+        if new_time - last_time > sleepTime:
+            last_time = new_time
+            print('\rNumber of valid cells: {}\trejected: {}'.format(len(accepted), nrejected))
+            QApplication.processEvents()
 
-    return list([valid_flag, grid_cell.grid_ref])
+    return accepted, accepted_easts, accepted_nrths, nrejected
+
+def _make_cell_keys(indx_easts, indx_nrths):
+    """
+    combine non-negative cell indices, each less than CELL_KEY_FACTOR, into single integer keys
+    """
+    return asarray(indx_easts, dtype=int64)*CELL_KEY_FACTOR + asarray(indx_nrths, dtype=int64)
+
+def _ring_offsets(ring):
+    """
+    easting and northing index offsets of the cells forming a square ring about a cell, in a fixed order
+    """
+    return [(de, dn) for de in range(-ring, ring + 1) for dn in range(-ring, ring + 1) if max(abs(de), abs(dn)) == ring]
 
 class CropCalendar_1km(object,):
 
@@ -270,44 +465,192 @@ class CropCalendar_1km(object,):
 
         self.nlines = nlines
         self.df = df
+        self.cell_index = None
+        self.cell_geometry = None
         print(mess)
         lggr.info(mess)
 
-class GridCell(object,):
+    def _build_cell_index(self, geometry):
+        """
+        index records by the easting and northing indices of the weather grid cell containing them
+        where a cell contains several records the first is used
+        """
+        gridsize, min_easting, min_nrthing = geometry
+        indx_easts = floor((self.df['Grid_Easting'].values - min_easting) / gridsize).astype(int64)
+        indx_nrths = floor((self.df['Grid_Northing'].values - min_nrthing) / gridsize).astype(int64)
+        inside = flatnonzero((indx_easts >= 0) & (indx_nrths >= 0))
+
+        keys, first_rows = unique(_make_cell_keys(indx_easts[inside], indx_nrths[inside]), return_index = True)
+        self.cell_index = Index(keys)
+        self.cell_rows = inside[first_rows]
+        self.cell_geometry = geometry
 
-    def __init__(self, grid_cell):
+        return
+
+    def _lookup_cells(self, indx_easts, indx_nrths):
         """
-        TODO: validate grid_cell
+        return record numbers of cells, or -1 where a cell has no record
         """
-        func_name = ' GridCell __init__'
-
-        if len(grid_cell) < 4:
-            print(WARN_STR + 'creating GridCell object, input list must have a minimum length of 4')
-            self.morecs_id = None
-            self.easting = None
-            self.nrthing = None
-            self.grid_ref = None
-        else:
-            self.morecs_id = grid_cell[0]
-            self.easting  = int(grid_cell[1])
-            self.nrthing = int(grid_cell[2])
-            self.grid_ref = grid_cell[3]
-
-        self.indx_east = None
-        self.indx_nrth = None
-        self.lat = None
-        self.lon = None
-        self.harvest = None # grid_cell[4:-2]
-
-        # map a default value of None to each of the weather, LTA and soil dictionary keys to represent the absence of
-        # a value which will later be assigned arrays
-        #
-        self.wthr = {}; self.lta = {}; self.soil = {}
-        for metric in METRICS:
-            self.wthr[metric] = None
-            self.lta[metric] = None
-'''
-  for property in form.soil_properties:
-            self.soil[property] = None
-'''
+        rows = full(len(indx_easts), -1, dtype=int64)
+        inside = (indx_easts >= 0) & (indx_nrths >= 0)
+        positions = self.cell_index.get_indexer(_make_cell_keys(indx_easts[inside], indx_nrths[inside]))
+        rows[inside] = where(positions >= 0, self.cell_rows[positions], -1)
+
+        return rows
+
+    def resolve_cells(self, eastings, nrthings, geometry, snap_rings = SNAP_RINGS):
+        """
+        snap arbitrary eastings and northings to the containing cell of the weather grid by grid arithmetic and return
+        the PLAN_NO_1km_ID, easting and northing of the crop calendar record for that cell
+        sites whose cell has no record take the record whose cell centre is nearest within snap_rings rings of cells
+        also returns flags of sites found and of sites snapped to a neighbouring cell
+        """
+        if self.cell_geometry != geometry:
+            self._build_cell_index(geometry)
+
+        gridsize, min_easting, min_nrthing = geometry
+        eastings = asarray(eastings, dtype=float64)
+        nrthings = asarray(nrthings, dtype=float64)
+
+        finite = isfinite(eastings) & isfinite(nrthings)
+        indx_easts = where(finite, floor((eastings - min_easting) / gridsize), -1).astype(int64)
+        indx_nrths = where(finite, floor((nrthings - min_nrthing) / gridsize), -1).astype(int64)
+        rows = self._lookup_cells(indx_easts, indx_nrths)
+
+        snapped_flags = full(len(rows), False)
+        for ring in range(1, snap_rings + 1):
+            unresolved = flatnonzero((rows < 0) & finite)
+            if len(unresolved) == 0:
+                break
+
+            best_rows = full(len(unresolved), -1, dtype=int64)
+            best_dists = full(len(unresolved), inf)
+            for de, dn in _ring_offsets(ring):
+                cand_easts = indx_easts[unresolved] + de
+                cand_nrths = indx_nrths[unresolved] + dn
+                cand_rows = self._lookup_cells(cand_easts, cand_nrths)
+                dists = hypot(min_easting + (cand_easts + 0.5)*gridsize - eastings[unresolved],
+                              min_nrthing + (cand_nrths + 0.5)*gridsize - nrthings[unresolved])
+                better = (cand_rows >= 0) & (dists < best_dists)
+                best_rows[better] = cand_rows[better]
+                best_dists[better] = dists[better]
+
+            rows[unresolved] = best_rows
+            snapped_flags[unresolved[best_rows >= 0]] = True
+
+        found_flags = rows >= 0
+        grid_refs = full(len(rows), None, dtype=object)
+        cell_eastings = full(len(rows), nan)
+        cell_nrthings = full(len(rows), nan)
+        grid_refs[found_flags] = self.df['PLAN_NO_1km_ID'].values[rows[found_flags]]
+        cell_eastings[found_flags] = self.df['Grid_Easting'].values[rows[found_flags]]
+        cell_nrthings[found_flags] = self.df['Grid_Northing'].values[rows[found_flags]]
+
+        return grid_refs, cell_eastings, cell_nrthings, found_flags, snapped_flags
+
+class GridCellSet(object,):
+
+    def __init__(self, column_chunks):
+        """
+        columnar store of grid cells, a NumPy array per attribute, which behaves as a dictionary of cells keyed by
+        grid_ref whose values are lightweight GridCellRow views exposing the attributes of one cell
+        columns are concatenated from a list of dictionaries of equal length arrays keyed by GRID_CELL_COLUMNS
+        """
+        self.columns = {}
+        for column, dtype in GRID_CELL_COLUMNS.items():
+            self.columns[column] = concatenate([asarray(chunk[column], dtype=dtype) for chunk in column_chunks]
+                                                                                                + [empty(0, dtype=dtype)])
+        ncells = len(self.columns['grid_ref'])
+        self.columns['mu_global'] = full(ncells, -1, dtype=int64)
+        self.columns['mu_globals_props'] = full(ncells, None, dtype=object)
+        self.columns['met_rel_path'] = full(ncells, None, dtype=object)
+
+        self.lta = {}   # arrays of cells by months, see add_data_to_grid_cells
+        self._positions = None
+
+    def __getattr__(self, attrib):
+        """
+        columns are available as attributes e.g. grid_cells.easting
+        """
+        if attrib != 'columns' and attrib in self.columns:
+            return self.columns[attrib]
+
+        raise AttributeError(attrib)
+
+    def __len__(self):
+        return len(self.columns['grid_ref'])
+
+    def __iter__(self):
+        return iter(self.columns['grid_ref'].tolist())
+
+    def __contains__(self, grid_ref):
+        return grid_ref in self.positions()
+
+    def __getitem__(self, grid_ref):
+        return GridCellRow(self, self.positions()[grid_ref])
+
+    def positions(self):
+        """
+        row number of each grid_ref, built on first use
+        """
+        if self._positions is None:
+            self._positions = {grid_ref: irow for irow, grid_ref in enumerate(self.columns['grid_ref'].tolist())}
+
+        return self._positions
+
+    def keys(self):
+        return self.columns['grid_ref'].tolist()
+
+    def values(self):
+        return [GridCellRow(self, irow) for irow in range(len(self))]
+
+    def items(self):
+        return [(grid_ref, GridCellRow(self, irow)) for irow, grid_ref in enumerate(self.keys())]
+
+    def take(self, irows):
+        """
+        new set comprising the given rows, in the given order
+        """
+        subset = GridCellSet([{column: self.columns[column][irows] for column in GRID_CELL_COLUMNS}])
+        for column in self.columns:
+            subset.columns[column] = self.columns[column][irows]
+        for metric in self.lta:
+            subset.lta[metric] = self.lta[metric][irows]
+
+        return subset
+
+    def batches(self, batch_size):
+        """
+        iterate over consecutive subsets of at most batch_size cells
+        """
+        for irow in range(0, len(self), batch_size):
+            yield self.take(slice(irow, irow + batch_size))
+
+class GridCellRow(object,):
+    """
+    view of one row of a GridCellSet with an attribute per column; assignments are written to the set
+    """
+    __slots__ = ('cell_set', 'irow')
+
+    def __init__(self, cell_set, irow):
+        object.__setattr__(self, 'cell_set', cell_set)
+        object.__setattr__(self, 'irow', irow)
+
+    def __getattr__(self, attrib):
+        if attrib == 'lta':
+            return {metric: vals[self.irow] for metric, vals in self.cell_set.lta.items()}
+
+        if attrib not in self.cell_set.columns:
+            raise AttributeError(attrib)
+
+        val = self.cell_set.columns[attrib][self.irow]
+        if getattr(val, 'ndim', None) == 0:
+            val = val.item()    # python scalars rather than numpy scalars
+
+        return val
+
+    def __setattr__(self, attrib, val):
+        if attrib not in self.cell_set.columns:
+            raise AttributeError(attrib)
 
+        self.cell_set.columns[attrib][self.irow] = val
@@ -12,55 +12,112 @@ __version__ = '0.0.1'
 __author__ = 's03mm5'
 
 from os import makedirs
-from os.path import isdir, join
+from os.path import isdir, join, normpath
 from PyQt5.QtWidgets import QApplication
+from numpy import unique
 
 from hwsd_bil import HWSD_bil
 from getClimGenNC import ClimGenNC
 from getClimGenFns import check_clim_nc_limits
-from getClimGenOsbgFns import fetch_chess_bbox_indices, open_chess_dsets, close_chess_dsets, add_data_to_grid_cells
+from getClimGenOsbgFns import (fetch_chess_bbox_indices, open_chess_dsets, close_chess_dsets, add_data_to_grid_cells,
+                                                                                                fetch_spatial_tiles)
+from grid_cell_classes_fns import fetch_valid_land, fetch_tile_cells
 from glbl_ecsse_high_level_fns import simplify_soil_recs
 from make_ltd_data_files import MakeLtdDataFiles
 from prepare_ecss_files_from_cell import make_ecss_files_from_cell
+from wthr_cell_cache import WthrCellCache
+from hwsd_batch_fns import HwsdRaster, HwsdCellTable, fetch_props_dicts
 
 MASK_FLAG = False
-snglPntFlag = True
+snglPntFlag = False     # if True, each cell takes the mu_global at its centre otherwise the composition of the cell
 
-def _generate_ecosse_files_for_cells(form, climgen, hwsd, grid_cells):
+WARN_STR = '*** Warning *** '
+
+_soil_recs = {}         # simplified soil records keyed by (mu_global, dom_soil_flag)
+_bad_mu_globals = set() # mu_globals without soil records
+
+def _fetch_hwsd_raster(form):
+    """
+    memory mapped HWSD raster is retained for the session
     """
+    if not hasattr(form, 'hwsd_raster') or form.hwsd_raster.hwsd_dir != normpath(form.hwsd_dir):
+        form.hwsd_raster = HwsdRaster(form.lgr, form.hwsd_dir)
 
+    return form.hwsd_raster
+
+def _fetch_hwsd_cell_table(form):
+    """
+    table of mu_globals for the CHESS lattice is built once and retained for the session
+    """
+    metric = 'precip'
+    valid_land = fetch_valid_land(form, form.wthr_sets['CHESS_historic']['ds_' + metric], metric)
+    hwsd_raster = _fetch_hwsd_raster(form)
+
+    if not hasattr(form, 'hwsd_cell_table') or form.hwsd_cell_table.hwsd_dir != hwsd_raster.hwsd_dir:
+        form.hwsd_cell_table = HwsdCellTable(form.lgr, hwsd_raster, valid_land, form.sttngs['cache_dir'])
+
+    return form.hwsd_cell_table
+
+def _load_soil_recs(form, hwsd, mu_globals, dom_soil_flag):
+    """
+    soil records are fetched and simplified only for those mu_globals not already loaded during this session
+    the soil records and bad mu_globals of form.hwsd_mu_globals are restricted to the given mu_globals
+    """
+    missing = sorted(mu_global for mu_global in set(mu_globals)
+                        if (mu_global, dom_soil_flag) not in _soil_recs and mu_global not in _bad_mu_globals)
+    if len(missing) > 0:
+        mu_global_pairs = {mu_global: None for mu_global in missing}
+        soil_recs = simplify_soil_recs(hwsd.get_soil_recs(mu_global_pairs), dom_soil_flag)
+        for mu_global in missing:
+            if mu_global in soil_recs:
+                _soil_recs[(mu_global, dom_soil_flag)] = soil_recs[mu_global]
+            else:
+                _bad_mu_globals.add(mu_global)
+        _bad_mu_globals.update(hwsd.bad_muglobals)
+        del (soil_recs)
+
+    form.hwsd_mu_globals.soil_recs = {mu_global: _soil_recs[(mu_global, dom_soil_flag)] for mu_global in set(mu_globals)
+                                                                    if (mu_global, dom_soil_flag) in _soil_recs}
+    form.hwsd_mu_globals.bad_mu_globals = [0] + sorted(_bad_mu_globals)
+
+    return
+
+def _generate_ecosse_files_for_cells(form, climgen, hwsd, grid_cells):
+    """
+    mu_globals of all cells, either at their centres if snglPntFlag is set or their compositions, are taken from the
+    table of mu_globals for the CHESS lattice with a single array index
     """
     # Initialise the limited data object with general settings that do not change between simulations
     # ===============================================================================================
     ltd_data = MakeLtdDataFiles(form, climgen, comments=True)  # create limited data object
 
-    for grid_ref in grid_cells.keys():
-        grid_cell = grid_cells[grid_ref]
+    hwsd_cell_table = _fetch_hwsd_cell_table(form)
+    if snglPntFlag:
+        grid_cells.mu_global[:] = hwsd_cell_table.fetch_mu_globals(grid_cells.indx_nrth, grid_cells.indx_east)
+        mu_globals_props = [{mu_global: 1.0} if mu_global > 0 else {} for mu_global in grid_cells.mu_global.tolist()]
+        all_mu_globals = grid_cells.mu_global[grid_cells.mu_global > 0]
+    else:
+        grid_cells.mu_global[:] = hwsd_cell_table.fetch_dominants(grid_cells.indx_nrth, grid_cells.indx_east)
+        cell_ptr, all_mu_globals, props = hwsd_cell_table.fetch_compositions(grid_cells.indx_nrth,
+                                                                                            grid_cells.indx_east)
+        mu_globals_props = fetch_props_dicts(cell_ptr, all_mu_globals, props)
 
-        # extract required values from the HWSD database
-        # ==============================================
-        lon = float(grid_cell.lon)
-        lat = float(grid_cell.lat)
-        nvals_read = hwsd.read_bbox_mu_globals([lon, lat], snglPntFlag)
+    for irow, cell_props in enumerate(mu_globals_props):
+        grid_cells.mu_globals_props[irow] = cell_props
 
-        # retrieve dictionary mu_globals and number of occurrences
-        # ========================================================
-        mu_globals = hwsd.get_mu_globals_dict()
-        if mu_globals is None:
-            print('No soil records for this area\n')
-            continue
+    dom_soil_flag = form.w_use_dom_soil.isChecked()
+    _load_soil_recs(form, hwsd, unique(all_mu_globals).tolist(), dom_soil_flag)
 
-        # create and instantiate a new class NB this stanza enables single site
-        # ==================================
-        hwsd_mu_globals = type('test', (), {})()
-        hwsd_mu_globals.soil_recs = hwsd.get_soil_recs(mu_globals)
-        if len(mu_globals) == 0:
-            print('No soil data for this area\n')
+    for grid_ref, mu_global, cell_props in zip(grid_cells.keys(), grid_cells.mu_global.tolist(), mu_globals_props):
+        if len(cell_props) == 0:
+            print('No soil records for this area\n')
             continue
 
-        grid_cell.mu_globals_props = {next(iter(mu_globals)): 1.0}
+        grid_cell = grid_cells[grid_ref]
 
-        mess = 'Cell {} has HWSD mu_global: {}'.format(grid_ref, list(grid_cell.mu_globals_props.keys())[0])
+        mess = 'Cell {} has HWSD mu_global: {}'.format(grid_ref, mu_global)
+        if len(cell_props) > 1:
+            mess += ' and {} others'.format(len(cell_props) - 1)
         form.lgr.info(mess); print(mess)
         QApplication.processEvents()
 
@@ -68,21 +125,18 @@ def _generate_ecosse_files_for_cells(form, climgen, hwsd, grid_cells):
 
     return
 
-def generate_grid_cell_sims(form, grid_cells):
+def _prepare_study(form):
     """
-    called from GUI
+    check weather resource and bounding box and create study directory and weather objects
+    soil records are loaded later, for the mu_globals of the selected cells only, see _load_soil_recs
+    returns climgen, hwsd and the CHESS index rectangle of the bounding box, or None
     """
     # weather choice
     # ==============
     wthr_rsrc = form.combo10w.currentText()
     if wthr_rsrc != 'CHESS':
         print('Weather resource must be CHESS')
-        return
-
-    if form.w_use_dom_soil.isChecked():
-        dom_soil_flag = True
-    else:
-        dom_soil_flag = False
+        return None
 
     # make sure bounding box is correctly set
     # =======================================
@@ -102,29 +156,32 @@ def generate_grid_cell_sims(form, grid_cells):
         form.historic_wthr_flag = wthr_rsrc
         form.future_climate_flag   = wthr_rsrc
     else:
-        return
+        return None
 
     # ========
     hwsd = HWSD_bil(form.lgr, form.hwsd_dir)
     climgen = ClimGenNC(form)
 
-    # TODO: patch to be sorted
-    # ========================
-    mu_global_pairs = {}
-    for mu_global in form.hwsd_mu_globals.mu_global_list:
-        mu_global_pairs[mu_global] = None
-
-    soil_recs = hwsd.get_soil_recs(mu_global_pairs)  # list is already sorted with bad muglobals removed
-    form.hwsd_mu_globals.soil_recs = simplify_soil_recs(soil_recs, dom_soil_flag)
-    form.hwsd_mu_globals.bad_mu_globals = [0] + hwsd.bad_muglobals
-    del (soil_recs)
-
     study = form.w_study.text()
     study_dir = join(form.sttngs['sims_dir'], study)
     if not isdir(study_dir):
         makedirs(study_dir)
     climgen.study = study
     climgen.study_dir = study_dir
+    climgen.cache_dir = form.sttngs['cache_dir']
+    climgen.realis = form.combo10r.currentText()
+    climgen.wthr_cache = WthrCellCache(form.lgr, form.sttngs['cache_dir'], form.sttngs['wthr_cache_mb'])
+
+    return climgen, hwsd, chess_extent
+
+def generate_grid_cell_sims(form, grid_cells):
+    """
+    called from GUI
+    """
+    study_objs = _prepare_study(form)
+    if study_objs is None:
+        return
+    climgen, hwsd, chess_extent = study_objs
 
     open_chess_dsets(climgen)
 
@@ -135,3 +192,48 @@ def generate_grid_cell_sims(form, grid_cells):
     close_chess_dsets(climgen)
 
     return
+
+def generate_spatial_sims(form):
+    """
+    called from GUI for the SPATIAL run mode
+    every valid CHESS cell within the bounding box is simulated; cells are processed one tile at a time, each tile
+    being read as a single block of the weather datasets, so that memory use does not depend on the size of the area
+    """
+    func_name = __prog__ + '  generate_spatial_sims'
+
+    study_objs = _prepare_study(form)
+    if study_objs is None:
+        return
+    climgen, hwsd, chess_extent = study_objs
+    nrth_ll, nrth_ur, east_ll, east_ur = chess_extent[:4]
+
+    metric = 'precip'
+    valid_land = fetch_valid_land(form, form.wthr_sets['CHESS_historic']['ds_' + metric], metric)
+
+    open_chess_dsets(climgen)
+
+    tiles = fetch_spatial_tiles(climgen, valid_land, nrth_ll, nrth_ur, east_ll, east_ur)
+    ntiles = len(tiles)
+    ncells = 0
+    nmissing = 0
+    for itile, (nrth_slice, east_slice) in enumerate(tiles):
+        grid_cells, nmissed = fetch_tile_cells(form, valid_land, nrth_slice, east_slice)
+        nmissing += nmissed
+        if len(grid_cells) == 0:
+            continue
+
+        mess = 'Tile {} of {}: {} cells'.format(itile + 1, ntiles, len(grid_cells))
+        form.lgr.info(mess); print(mess)
+        QApplication.processEvents()
+
+        add_data_to_grid_cells(climgen, grid_cells)
+        _generate_ecosse_files_for_cells(form, climgen, hwsd, grid_cells)
+        ncells += len(grid_cells)
+
+    close_chess_dsets(climgen)
+
+    mess = 'Processed {} cells in {} tiles\t{} valid cells not in OSGB lookup file'.format(ncells, ntiles, nmissing)
+    form.lgr.info(mess + ' in function ' + func_name)
+    print(mess)
+
+    return
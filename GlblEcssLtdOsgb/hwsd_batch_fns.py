@@ -0,0 +1,273 @@
+#-------------------------------------------------------------------------------
+# Name:        hwsd_batch_fns.py
+# Purpose:     batch access to the HWSD raster for sets of grid cells
+# Licence:     <your licence>
+# Description:
+#   the HWSD raster, hwsd.bil, is memory mapped and the mu_globals of any number of locations are found with one
+#   vectorised index computation; geometry is taken from the accompanying hwsd.hdr file, if present
+#   the mu_global at the centre of every cell of the CHESS lattice, and its composition, is computed once and saved
+#   in the cache directory against the identities of the HWSD raster and the weather file, see HwsdCellTable
+#-------------------------------------------------------------------------------
+
+__prog__ = 'hwsd_batch_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from os.path import isfile, join, normpath, lexists
+from os import makedirs
+from hashlib import md5
+from time import time
+
+from numpy import (memmap, asarray, rint, zeros, isfinite, where, int64, int32, float32, float64, arange, meshgrid,
+                   repeat, unique, bincount, cumsum, concatenate, lexsort, nonzero, full, array, savez, load as np_load)
+
+from chess_valid_land_fns import fetch_file_identity
+from osgb_coord_fns import osgb36_to_wgs84
+
+ERROR_STR = '*** Error *** '
+WARN_STR = '*** Warning *** '
+
+HWSD_BIL = 'hwsd.bil'
+HWSD_HDR = 'hwsd.hdr'
+TABLE_PREFIX = 'hwsd_cells_'
+TABLE_ARRAYS = ['centre', 'dominant', 'cell_rows', 'cell_ptr', 'mu_globals', 'props']
+COMPOSITION_SAMPLES = 4     # composition of each cell is taken from this number squared of sample points
+COMPOSITION_CHUNK = 65536   # number of cells processed in one go when computing compositions
+MU_GLOBAL_KEY = 2**32       # mu_globals are less than this
+PROPS_DECIMALS = 4
+
+# 30 arc second global grid, the upper left map coordinates are those of the centre of the upper left pixel
+# ========================================================================================================
+HDR_DFLTS = {'NROWS': 21600, 'NCOLS': 43200, 'NBITS': 16, 'BYTEORDER': 'I',
+             'ULXMAP': -180.0 + 1/240, 'ULYMAP': 90.0 - 1/240, 'XDIM': 1/120, 'YDIM': 1/120}
+
+def _read_hdr(hdr_fn):
+    """
+    ESRI BIL header comprising lines of keyword and value
+    """
+    hdr = dict(HDR_DFLTS)
+    if isfile(hdr_fn):
+        with open(hdr_fn, 'r') as fobj:
+            for line in fobj:
+                fields = line.split()
+                if len(fields) == 2 and fields[0].upper() in HDR_DFLTS:
+                    key = fields[0].upper()
+                    hdr[key] = fields[1] if key == 'BYTEORDER' else float(fields[1])
+
+    return hdr
+
+class HwsdRaster(object,):
+
+    def __init__(self, lggr, hwsd_dir):
+        """
+        memory map of the raster of mu_globals
+        """
+        self.lggr = lggr
+        self.hwsd_dir = normpath(hwsd_dir)
+        self.bil_fname = join(self.hwsd_dir, HWSD_BIL)
+
+        hdr = _read_hdr(join(self.hwsd_dir, HWSD_HDR))
+        self.nrows, self.ncols = int(hdr['NROWS']), int(hdr['NCOLS'])
+        self.ulxmap, self.ulymap = hdr['ULXMAP'], hdr['ULYMAP']
+        self.xdim, self.ydim = hdr['XDIM'], hdr['YDIM']
+
+        byteorder = '<' if hdr['BYTEORDER'].upper() == 'I' else '>'
+        dtype = byteorder + ('u2' if int(hdr['NBITS']) == 16 else 'u4')
+        self.raster = memmap(self.bil_fname, dtype = dtype, mode = 'r', shape = (self.nrows, self.ncols))
+
+        lggr.info('Memory mapped HWSD raster {} of {} rows and {} columns'.format(self.bil_fname, self.nrows, self.ncols))
+
+    def fetch_rows_cols(self, lons, lats):
+        """
+        raster rows and columns of the pixels containing each location and flags of locations within the raster
+        """
+        lons = asarray(lons, dtype=float64)
+        lats = asarray(lats, dtype=float64)
+        finite = isfinite(lons) & isfinite(lats)
+
+        rows = where(finite, rint((self.ulymap - lats) / self.ydim), -1).astype(int64)
+        cols = where(finite, rint((lons - self.ulxmap) / self.xdim), -1).astype(int64)
+        inside = (rows >= 0) & (rows < self.nrows) & (cols >= 0) & (cols < self.ncols)
+
+        return rows, cols, inside
+
+    def fetch_mu_globals(self, lons, lats):
+        """
+        mu_global of the pixel containing each location, zero where the location is outside the raster
+        """
+        rows, cols, inside = self.fetch_rows_cols(lons, lats)
+
+        mu_globals = zeros(len(rows), dtype=int64)
+        mu_globals[inside] = self.raster[rows[inside], cols[inside]]
+
+        return mu_globals
+
+    def fetch_compositions(self, eastings, nrthings, gridsize, nsub = COMPOSITION_SAMPLES):
+        """
+        proportions of mu_globals within square cells of side gridsize centred on OSGB eastings and northings
+        from an nsub by nsub histogram of sample points; pixels without soil, mu_global 0, are excluded
+        longitudes and latitudes of sample points are interpolated within each cell from the centre and its neighbours
+        returns, in compressed sparse row form, pointers to the first entry of each cell then mu_globals and proportions
+        """
+        offsets = (arange(nsub) + 0.5)/nsub - 0.5
+        frac_easts, frac_nrths = [vals.ravel() for vals in meshgrid(offsets, offsets)]
+
+        cell_counts = []
+        mu_globals = []
+        props = []
+        for cell_lo in range(0, len(eastings), COMPOSITION_CHUNK):
+            chunk_eastings = asarray(eastings[cell_lo:cell_lo + COMPOSITION_CHUNK], dtype=float64)
+            chunk_nrthings = asarray(nrthings[cell_lo:cell_lo + COMPOSITION_CHUNK], dtype=float64)
+            ncells = len(chunk_eastings)
+
+            lon_cntr, lat_cntr = osgb36_to_wgs84(chunk_eastings, chunk_nrthings)
+            lon_east, lat_east = osgb36_to_wgs84(chunk_eastings + gridsize, chunk_nrthings)
+            lon_nrth, lat_nrth = osgb36_to_wgs84(chunk_eastings, chunk_nrthings + gridsize)
+            lons = lon_cntr[:, None] + (lon_east - lon_cntr)[:, None]*frac_easts + (lon_nrth - lon_cntr)[:, None]*frac_nrths
+            lats = lat_cntr[:, None] + (lat_east - lat_cntr)[:, None]*frac_easts + (lat_nrth - lat_cntr)[:, None]*frac_nrths
+            samples = self.fetch_mu_globals(lons.ravel(), lats.ravel())
+
+            # histogram of (cell, mu_global) pairs, ordered by cell then mu_global
+            # ===================================================================
+            cells = repeat(arange(ncells, dtype=int64), nsub*nsub)
+            soil = samples > 0
+            keys, counts = unique(cells[soil]*MU_GLOBAL_KEY + samples[soil], return_counts = True)
+            key_cells = keys // MU_GLOBAL_KEY
+
+            cell_counts.append(bincount(key_cells, minlength = ncells))
+            mu_globals.append((keys % MU_GLOBAL_KEY).astype(int32))
+            props.append((counts / bincount(key_cells, weights = counts, minlength = ncells)[key_cells]).astype(float32))
+
+        cell_ptr = concatenate(([0], cumsum(concatenate(cell_counts + [zeros(0, dtype=int64)])))).astype(int64)
+
+        return cell_ptr, concatenate(mu_globals + [zeros(0, dtype=int32)]), concatenate(props + [zeros(0, dtype=float32)])
+
+def fetch_dominant(cell_ptr, mu_globals, props):
+    """
+    mu_global with the largest proportion in each cell, the lowest mu_global where proportions are equal
+    zero for cells without soil
+    """
+    ncells = len(cell_ptr) - 1
+    cells = repeat(arange(ncells), cell_ptr[1:] - cell_ptr[:-1])
+    order = lexsort((mu_globals, -props, cells))
+    firsts = order[cell_ptr[:-1][cell_ptr[1:] > cell_ptr[:-1]]]
+
+    dominant = zeros(ncells, dtype=int32)
+    dominant[cells[firsts]] = mu_globals[firsts]
+
+    return dominant
+
+def fetch_props_dicts(cell_ptr, mu_globals, props):
+    """
+    dictionary of proportions keyed by mu_global for each cell, empty for cells without soil
+    """
+    mu_globals = mu_globals.tolist()
+    props = props.astype(float64).round(PROPS_DECIMALS).tolist()
+
+    return [dict(zip(mu_globals[ptr_lo:ptr_hi], props[ptr_lo:ptr_hi]))
+                                                for ptr_lo, ptr_hi in zip(cell_ptr[:-1].tolist(), cell_ptr[1:].tolist())]
+
+def _table_fname(cache_dir, bil_fname, nc_fname):
+    """
+    tables are keyed by the paths of the HWSD raster and of the weather file defining the lattice
+    """
+    path_hash = md5((normpath(bil_fname) + '|' + normpath(nc_fname)).encode('utf-8')).hexdigest()[:16]
+
+    return join(cache_dir, TABLE_PREFIX + path_hash + '.npz')
+
+class HwsdCellTable(object,):
+
+    def __init__(self, lggr, hwsd_raster, valid_land, cache_dir):
+        """
+        mu_global at the centre of every CHESS cell with weather data, zero elsewhere, the composition of each cell and
+        its dominant mu_global
+        read from the cache directory if the identities of the HWSD raster and weather file match, otherwise built
+        """
+        self.lggr = lggr
+        self.hwsd_dir = hwsd_raster.hwsd_dir
+        self.centre = None
+        self.dominant = None
+
+        identity = list(fetch_file_identity(hwsd_raster.bil_fname)) + list(fetch_file_identity(valid_land.nc_fname))
+        identity = [str(val) for val in identity]
+        table_fn = _table_fname(cache_dir, hwsd_raster.bil_fname, valid_land.nc_fname)
+        if isfile(table_fn) and self._read_table(table_fn, identity):
+            return
+
+        self._build_table(hwsd_raster, valid_land)
+
+        if not lexists(cache_dir):
+            makedirs(cache_dir)
+
+        savez(table_fn, identity = array(identity), **{name: getattr(self, name) for name in TABLE_ARRAYS})
+
+        mess = 'Wrote table of HWSD mu_globals for {} CHESS cells to {}'.format(int((self.dominant > 0).sum()), table_fn)
+        print(mess); lggr.info(mess)
+
+    def _read_table(self, table_fn, identity):
+        """
+        return True if table describes the current HWSD raster and weather file and has all arrays
+        """
+        with np_load(table_fn) as table:
+            if list(table['identity']) != identity or any(name not in table for name in TABLE_ARRAYS):
+                self.lggr.info(WARN_STR + 'HWSD cell table ' + table_fn + ' is out of date - will rebuild')
+                return False
+
+            for name in TABLE_ARRAYS:
+                setattr(self, name, table[name])
+
+        self.lggr.info('Read HWSD cell table ' + table_fn)
+
+        return True
+
+    def _build_table(self, hwsd_raster, valid_land):
+        """
+        look up the mu_global at the centre of each cell with weather data and its composition from a histogram
+        """
+        print('Building table of HWSD mu_globals for the CHESS grid - this is done once...')
+        start_time = time()
+
+        indx_nrths, indx_easts = nonzero(valid_land.valid)
+        eastings = valid_land.min_easting + (indx_easts + 0.5)*valid_land.gridsize
+        nrthings = valid_land.min_nrthing + (indx_nrths + 0.5)*valid_land.gridsize
+
+        lons, lats = osgb36_to_wgs84(eastings, nrthings)
+        self.centre = zeros(valid_land.valid.shape, dtype=int32)
+        self.centre[indx_nrths, indx_easts] = hwsd_raster.fetch_mu_globals(lons, lats)
+
+        self.cell_ptr, self.mu_globals, self.props = hwsd_raster.fetch_compositions(eastings, nrthings,
+                                                                                            valid_land.gridsize)
+        self.dominant = zeros(valid_land.valid.shape, dtype=int32)
+        self.dominant[indx_nrths, indx_easts] = fetch_dominant(self.cell_ptr, self.mu_globals, self.props)
+        self.cell_rows = full(valid_land.valid.shape, -1, dtype=int32)
+        self.cell_rows[indx_nrths, indx_easts] = arange(len(indx_nrths))
+
+        self.lggr.info('Built HWSD cell table in {} seconds'.format(round(time() - start_time, 1)))
+
+    def fetch_mu_globals(self, indx_nrths, indx_easts):
+        """
+        mu_globals at the centres of cells given by their weather grid indices
+        """
+        return self.centre[indx_nrths, indx_easts].astype(int64)
+
+    def fetch_dominants(self, indx_nrths, indx_easts):
+        """
+        mu_globals with the largest proportion in cells given by their weather grid indices
+        """
+        return self.dominant[indx_nrths, indx_easts].astype(int64)
+
+    def fetch_compositions(self, indx_nrths, indx_easts):
+        """
+        compositions of cells given by their weather grid indices, in the compressed sparse row form of
+        HwsdRaster.fetch_compositions; cells without weather data have no entries
+        """
+        rows = self.cell_rows[indx_nrths, indx_easts].astype(int64)
+        present = rows >= 0
+        counts = where(present, self.cell_ptr[rows + 1] - self.cell_ptr[rows], 0)
+
+        cell_ptr = concatenate(([0], cumsum(counts))).astype(int64)
+        entries = repeat(self.cell_ptr[rows] - cell_ptr[:-1], counts) + arange(cell_ptr[-1])
+
+        return cell_ptr, self.mu_globals[entries], self.props[entries]
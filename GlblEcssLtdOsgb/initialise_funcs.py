@@ -37,6 +37,7 @@ WARN_STR = '*** Warning *** '
 ERROR_STR = '*** Error *** '
 BBOX_DEFAULT = [-4.8, 52.54, -3.42, 53.33] # lon_ll, lat_ll, lon_ur, lat_ur - Gwynedd, Wales
 sleepTime = 5
+WTHR_CACHE_MB_DFLT = 2048     # disk budget of weather cache, see wthr_cell_cache.py
 
 SETTINGS_LIST = ['config_dir', 'csv_1km_fname', 'fname_png', 'hwsd_dir', 'hwsd_csv_fname', 'log_dir', 
                 'lta_nc_fname', 'mask_fn', 'shp_dir', 'sims_dir', 'weather_dir']
@@ -152,6 +153,25 @@ def _read_setup_file(form, fname_setup):
     wthr_dir     = settings[grp]['weather_dir']
     csv_1km_fname = settings[grp]['csv_1km_fname']
 
+    # optional directory for lookup tables and caches which persist between sessions
+    # ===============================================================================
+    if 'cache_dir' in settings[grp]:
+        cache_dir = settings[grp]['cache_dir']
+    else:
+        cache_dir = join(config_dir, 'cache')
+        settings[grp]['cache_dir'] = cache_dir
+
+    if 'wthr_cache_mb' not in settings[grp]:
+        settings[grp]['wthr_cache_mb'] = WTHR_CACHE_MB_DFLT
+
+    # optional seed and stratification by MORECS region for random selection of cells
+    # ================================================================================
+    if 'rndm_seed' not in settings[grp]:
+        settings[grp]['rndm_seed'] = None
+
+    if 'rndm_stratify' not in settings[grp]:
+        settings[grp]['rndm_stratify'] = False
+
     # check directories exist for configuration and log files
     # ========================================================
     if not lexists(log_dir):
@@ -166,6 +186,9 @@ def _read_setup_file(form, fname_setup):
     if not lexists(config_dir):
         makedirs(config_dir)
 
+    if not lexists(cache_dir):
+        makedirs(cache_dir)
+
     # ==============
     if isfile(hwsd_csv_fname):
         # read CSV file using pandas and create obj
@@ -0,0 +1,152 @@
+#-------------------------------------------------------------------------------
+# Name:        land_use_mask_fns.py
+# Purpose:     land use mask rasterised onto the CHESS 1 km lattice
+# Licence:     <your licence>
+# Description:
+#   the mask is a NetCDF file with either OSGB x, y or geographic lat, lon coordinates; each CHESS cell with weather
+#   data takes the value of the mask cell nearest its centre and is retained where that value is positive
+#   the rasterised mask is saved in the cache directory and reused whilst the mask and weather files are unchanged
+#-------------------------------------------------------------------------------
+
+__prog__ = 'land_use_mask_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from os.path import isfile, join, normpath, lexists
+from os import makedirs
+from hashlib import md5
+from time import time
+
+from numpy import (asarray, zeros, nonzero, full, abs as np_abs, searchsorted, clip, where, int64, float64, packbits,
+                                                                        unpackbits, savez, load as np_load, array)
+from numpy.ma import filled
+
+from nc_dset_pool import fetch_nc_dset
+from chess_valid_land_fns import fetch_file_identity
+from osgb_coord_fns import osgb36_to_wgs84
+
+ERROR_STR = '*** Error *** '
+WARN_STR = '*** Warning *** '
+
+MASK_PREFIX = 'land_use_mask_'
+COORD_NAMES = [('x', 'y'), ('lon', 'lat'), ('longitude', 'latitude')]
+
+def _mask_fname(cache_dir, mask_fn, nc_fname):
+    """
+    rasterised masks are keyed by the paths of the mask file and of the weather file defining the lattice
+    """
+    path_hash = md5((normpath(mask_fn) + '|' + normpath(nc_fname)).encode('utf-8')).hexdigest()[:16]
+
+    return join(cache_dir, MASK_PREFIX + path_hash + '.npz')
+
+def fetch_nearest_indices(coords, vals):
+    """
+    indices of the nearest values of a monotonic coordinate array, -1 where more than half a cell beyond either end
+    """
+    coords = asarray(coords, dtype=float64)
+    descending = coords[0] > coords[-1]
+    if descending:
+        coords = coords[::-1]
+
+    upper = clip(searchsorted(coords, vals), 1, len(coords) - 1)
+    lower = upper - 1
+    indices = where(np_abs(vals - coords[lower]) <= np_abs(coords[upper] - vals), lower, upper)
+
+    half_cell = np_abs(coords[-1] - coords[0]) / max(1, len(coords) - 1) / 2.0
+    outside = (vals < coords[0] - half_cell) | (vals > coords[-1] + half_cell)
+    if descending:
+        indices = len(coords) - 1 - indices
+
+    return where(outside, -1, indices).astype(int64)
+
+def find_grid_variable(nc_vars, nc_fname):
+    """
+    names of the x and y coordinates, either OSGB or geographic, and the first variable gridded on them
+    """
+    coord_names = None
+    for x_name, y_name in COORD_NAMES:
+        if x_name in nc_vars and y_name in nc_vars:
+            coord_names = (x_name, y_name)
+            break
+
+    if coord_names is None:
+        raise ValueError(nc_fname + ' must have x, y or lon, lat coordinates')
+
+    x_name, y_name = coord_names
+    for var_name, nc_var in nc_vars.items():
+        if nc_var.ndim >= 2 and nc_var.dimensions[-2:] == (y_name, x_name):
+            return x_name, y_name, nc_var
+
+    raise ValueError(nc_fname + ' has no variable with dimensions ' + y_name + ', ' + x_name)
+
+class LandUseMask(object,):
+
+    def __init__(self, lggr, mask_fn, valid_land, cache_dir):
+        """
+        boolean array, the shape of the valid land bitmap, of cells to be retained
+        read from the cache directory if the identities of the mask and weather files match, otherwise rasterised
+        """
+        self.lggr = lggr
+        self.mask_fn = normpath(mask_fn)
+        self.retain = None
+
+        identity = list(fetch_file_identity(mask_fn)) + list(fetch_file_identity(valid_land.nc_fname))
+        identity = [str(val) for val in identity]
+        mask_cache_fn = _mask_fname(cache_dir, mask_fn, valid_land.nc_fname)
+        if isfile(mask_cache_fn):
+            with np_load(mask_cache_fn) as cached:
+                if list(cached['identity']) == identity:
+                    nrows, ncols = int(cached['nrows']), int(cached['ncols'])
+                    self.retain = unpackbits(cached['bits'], count = nrows*ncols).reshape(nrows, ncols).astype(bool)
+                    lggr.info('Read land use mask ' + mask_cache_fn)
+                    return
+
+        self._rasterise(valid_land)
+
+        if not lexists(cache_dir):
+            makedirs(cache_dir)
+
+        nrows, ncols = self.retain.shape
+        savez(mask_cache_fn, bits = packbits(self.retain), nrows = nrows, ncols = ncols, identity = array(identity))
+
+        mess = 'Wrote land use mask retaining {} cells to {}'.format(int(self.retain.sum()), mask_cache_fn)
+        print(mess); lggr.info(mess)
+
+    def _rasterise(self, valid_land):
+        """
+        sample the mask at the centre of each CHESS cell with weather data using one windowed read of the mask
+        """
+        print('Rasterising land use mask ' + self.mask_fn + ' onto the CHESS grid...')
+        start_time = time()
+
+        nc_vars = fetch_nc_dset(self.mask_fn).variables
+        x_name, y_name, mask_var = find_grid_variable(nc_vars, 'land use mask ' + self.mask_fn)
+
+        # centres of cells with weather data
+        # ==================================
+        indx_nrths, indx_easts = nonzero(valid_land.valid)
+        xvals = valid_land.min_easting + (indx_easts + 0.5)*valid_land.gridsize
+        yvals = valid_land.min_nrthing + (indx_nrths + 0.5)*valid_land.gridsize
+        if x_name != 'x':
+            xvals, yvals = osgb36_to_wgs84(xvals, yvals)
+
+        mask_cols = fetch_nearest_indices(nc_vars[x_name][:], xvals)
+        mask_rows = fetch_nearest_indices(nc_vars[y_name][:], yvals)
+        inside = (mask_cols >= 0) & (mask_rows >= 0)
+
+        retain = zeros(valid_land.valid.shape, dtype = bool)
+        if inside.any():
+            row_lo, row_hi = int(mask_rows[inside].min()), int(mask_rows[inside].max()) + 1
+            col_lo, col_hi = int(mask_cols[inside].min()), int(mask_cols[inside].max()) + 1
+            lead_indices = (0,)*(mask_var.ndim - 2)
+            window = filled(mask_var[lead_indices + (slice(row_lo, row_hi), slice(col_lo, col_hi))], 0)
+
+            flags = full(len(indx_nrths), False)
+            flags[inside] = window[mask_rows[inside] - row_lo, mask_cols[inside] - col_lo] > 0
+            retain[indx_nrths, indx_easts] = flags
+
+        self.retain = retain
+
+        self.lggr.info('Rasterised land use mask in {} seconds'.format(round(time() - start_time, 1)))
@@ -0,0 +1,147 @@
+#-------------------------------------------------------------------------------
+# Name:        met_file_fns.py
+# Purpose:     fast formatting and writing of ECOSSE met files
+# Licence:     <your licence>
+# Description:
+#   each met file comprises 12 tab separated rows of month, precipitation, PET and mean temperature; the text of a
+#   year is rendered from arrays with a single % operation and written with a single call
+#   output is byte identical to that of csv.writer with values rounded by round(value, 2): %.2f gives the same
+#   digits and a trailing zero of the second decimal is dropped, as str does
+#
+#   usage: python met_file_fns.py [-n NFILES] out_dir    micro-benchmark of the per-file cost
+#-------------------------------------------------------------------------------
+#!/usr/bin/env python
+
+__prog__ = 'met_file_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from argparse import ArgumentParser
+from csv import writer as csv_writer
+from os.path import join, lexists
+from os import makedirs
+from re import compile as re_compile
+from time import time
+
+from numpy import arange, empty, isfinite, abs as np_abs, float64
+from numpy.random import default_rng
+
+MNTHS_YR = 12
+MET_ROW_FMT = '%d\t%.2f\t%.2f\t%.2f\r\n'        # csv.writer terminates rows with \r\n
+MET_YEAR_FMT = MET_ROW_FMT*MNTHS_YR
+MAX_FIXED_VALUE = 1.0e15        # str switches to exponent notation at 1e16
+NFILES_DFLT = 10000
+
+_trailing_zero = re_compile(r'(\.\d)0(?=[\t\r])')
+
+def fetch_met_values(precips, pets, temp_means):
+    """
+    array of years by months by columns, month number first, from arrays of years by months, see fetch_met_arrays
+    """
+    nyears = len(temp_means)
+    met_values = empty((nyears, MNTHS_YR, 4), dtype=float64)
+    met_values[:, :, 0] = arange(1, MNTHS_YR + 1)
+    met_values[:, :, 1] = precips[:nyears]
+    met_values[:, :, 2] = pets[:nyears]
+    met_values[:, :, 3] = temp_means
+
+    return met_values
+
+def _format_met_year_csv(year_values):
+    """
+    text of one met file as written by csv.writer, used where values are too large for fixed point notation
+    """
+    rows = [[int(row[0])] + [round(val, 2) for val in row[1:]] for row in year_values.tolist()]
+    lines = ['\t'.join(str(val) for val in row) + '\r\n' for row in rows]
+
+    return ''.join(lines)
+
+def format_met_year(year_values):
+    """
+    text of one met file from an array of months by columns
+    """
+    finite = isfinite(year_values)
+    if (np_abs(year_values[finite]) >= MAX_FIXED_VALUE).any():
+        return _format_met_year_csv(year_values)
+
+    return _trailing_zero.sub(r'\1', MET_YEAR_FMT % tuple(year_values.ravel().tolist()))
+
+def write_met_file(met_path, year_values):
+    """
+    write one met file with a single call
+    """
+    with open(met_path, 'w', newline='') as fpout:
+        fpout.write(format_met_year(year_values))
+
+    return
+
+def _write_met_file_csv(met_path, year_values):
+    """
+    met file written as before, by rounding values and using csv.writer, for comparison with write_met_file
+    """
+    output = [[int(row[0])] + [round(val, 2) for val in row[1:]] for row in year_values.tolist()]
+    with open(met_path, 'w', newline='') as fpout:
+        writer = csv_writer(fpout, delimiter='\t')
+        writer.writerows(output)
+
+    return
+
+def benchmark_met_writers(out_dir, nfiles = NFILES_DFLT):
+    """
+    time per file of formatting alone and of writing, for write_met_file and the csv.writer approach
+    returns True if all files are byte identical
+    """
+    if not lexists(out_dir):
+        makedirs(out_dir)
+
+    rng = default_rng(0)
+    precips = rng.random((nfiles, MNTHS_YR))*200.0
+    pets = rng.random((nfiles, MNTHS_YR))*120.0
+    temp_means = rng.random((nfiles, MNTHS_YR))*35.0 - 10.0
+    met_values = fetch_met_values(precips, pets, temp_means)
+
+    start_time = time()
+    for year_values in met_values:
+        format_met_year(year_values)
+    format_secs = time() - start_time
+
+    timings = {}
+    for label, writer_func in (('csv', _write_met_file_csv), ('fast', write_met_file)):
+        start_time = time()
+        for ifile, year_values in enumerate(met_values):
+            writer_func(join(out_dir, '{}{}.txt'.format(label, ifile)), year_values)
+        timings[label] = time() - start_time
+
+    identical_flag = True
+    for ifile in range(nfiles):
+        with open(join(out_dir, 'csv{}.txt'.format(ifile)), 'rb') as fcsv, \
+                                                    open(join(out_dir, 'fast{}.txt'.format(ifile)), 'rb') as ffast:
+            if fcsv.read() != ffast.read():
+                identical_flag = False
+                print('Files differ for file number {}'.format(ifile))
+                break
+
+    print('Formatting: {} microseconds per file'.format(round(1.0e6*format_secs/nfiles, 1)))
+    for label in timings:
+        print('Writing with {}: {} microseconds per file'.format(label, round(1.0e6*timings[label]/nfiles, 1)))
+    print('Output is byte identical: {}'.format(identical_flag))
+
+    return identical_flag
+
+def main():
+    """
+    micro-benchmark of met file writing
+    """
+    parser = ArgumentParser(description='Compare the per-file cost of met file writers')
+    parser.add_argument('out_dir', help='directory for benchmark files')
+    parser.add_argument('-n', '--nfiles', type=int, default=NFILES_DFLT, help='number of files to write')
+    args = parser.parse_args()
+
+    benchmark_met_writers(args.out_dir, args.nfiles)
+
+    return
+
+if __name__ == '__main__':
+    main()
@@ -16,7 +16,7 @@ from os.path import isdir, join, isfile
 from time import strftime, sleep
 from csv import writer
 
-from cvrtcoord import OSGB36toWGS84, WGS84toOSGB36
+from osgb_coord_fns import osgb36_to_wgs84, wgs84_to_osgb36
 
 OSGB_FNAME = 'coords_osgb'
 WGS84_FNAME = 'coords_wgs84'
@@ -46,18 +46,20 @@ def write_coords_check_file(log_dir, grid_cells):
     hfry_writer = writer(hfry_obj, delimiter=',')
     hfry_writer.writerow(['grid_ref', 'easting', 'nrthing', 'hf_lat', 'hf_lon', 'lat', 'lon', 'hf_esting', 'hf_nrthng'])
 
-    for grid_ref in grid_cells.keys():
-        grid_cell = grid_cells[grid_ref]
+    # convert all cells in one go
+    # ===========================
+    grid_refs = grid_cells.keys()
+    lats = grid_cells.lat.tolist()
+    lons = grid_cells.lon.tolist()
+    eastings = grid_cells.easting.tolist()
+    nrthings = grid_cells.nrthing.tolist()
 
-        lat, lon = grid_cell.lat, grid_cell.lon
-        wgs84_writer.writerow([lat, lon, grid_ref])
+    hf_estings, hf_nrthngs = [vals.tolist() for vals in wgs84_to_osgb36(lons, lats)]
+    hf_lons, hf_lats = [vals.tolist() for vals in osgb36_to_wgs84(eastings, nrthings)]
 
-        easting, nrthing = grid_cell.easting, grid_cell.nrthing
-        osgb_writer.writerow([easting, nrthing, grid_ref])
-
-        hf_esting, hf_nrthng = WGS84toOSGB36(lon, lat)
-        hf_lon, hf_lat = OSGB36toWGS84(easting, nrthing)
-        hfry_writer.writerow([grid_ref, easting, nrthing, hf_lat, hf_lon, lat, lon, hf_esting, hf_nrthng])
+    wgs84_writer.writerows(zip(lats, lons, grid_refs))
+    osgb_writer.writerows(zip(eastings, nrthings, grid_refs))
+    hfry_writer.writerows(zip(grid_refs, eastings, nrthings, hf_lats, hf_lons, lats, lons, hf_estings, hf_nrthngs))
 
     osgb_obj.close()
     wgs84_obj.close()
@@ -0,0 +1,74 @@
+#-------------------------------------------------------------------------------
+# Name:        nc_dset_pool.py
+# Purpose:     process-wide pool of open NetCDF datasets
+# Licence:     <your licence>
+# Description:
+#   datasets, their variable objects and x, y coordinate arrays are kept open and warm across cell selection,
+#   weather extraction and consecutive studies in one session until released with evict_nc_dsets
+#-------------------------------------------------------------------------------
+
+__prog__ = 'nc_dset_pool.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from os.path import normpath
+
+from netCDF4 import Dataset
+
+_pool = {}      # entries keyed by normalised file name
+
+def _fetch_entry(fname):
+    """
+    open dataset on first request
+    """
+    key = normpath(fname)
+    if key not in _pool:
+        _pool[key] = {'dset': Dataset(key, 'r'), 'vars': {}, 'coords': None}
+
+    return _pool[key]
+
+def fetch_nc_dset(fname):
+    """
+    return open dataset
+    """
+    return _fetch_entry(fname)['dset']
+
+def fetch_nc_var(fname, var_name):
+    """
+    return variable object of an open dataset
+    """
+    entry = _fetch_entry(fname)
+    if var_name not in entry['vars']:
+        entry['vars'][var_name] = entry['dset'].variables[var_name]
+
+    return entry['vars'][var_name]
+
+def fetch_nc_coords(fname):
+    """
+    return x and y coordinate arrays of an open dataset
+    """
+    entry = _fetch_entry(fname)
+    if entry['coords'] is None:
+        nc_vars = entry['dset'].variables
+        entry['coords'] = {'x': nc_vars['x'][:], 'y': nc_vars['y'][:]}
+
+    return entry['coords']
+
+def evict_nc_dsets(fname = None):
+    """
+    close and release one dataset or, by default, all datasets
+    """
+    if fname is None:
+        keys = list(_pool.keys())
+    else:
+        keys = [normpath(fname)]
+
+    nevicted = 0
+    for key in keys:
+        if key in _pool:
+            _pool.pop(key)['dset'].close()
+            nevicted += 1
+
+    return nevicted
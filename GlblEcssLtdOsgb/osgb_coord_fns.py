@@ -0,0 +1,210 @@
+#-------------------------------------------------------------------------------
+# Name:        osgb_coord_fns.py
+# Purpose:     array based conversion between OSGB36 eastings and northings and WGS84 longitudes and latitudes
+# Licence:     <your licence>
+# Description:
+#   vectorised equivalents of WGS84toOSGB36 and OSGB36toWGS84 in cvrtcoord, with the same argument and return order
+#   follows the Ordnance Survey guide to coordinate systems in Great Britain: transverse Mercator projection of the
+#   Airy 1830 ellipsoid and a seven parameter Helmert transformation, accurate to a few metres
+#-------------------------------------------------------------------------------
+
+__prog__ = 'osgb_coord_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from numpy import (asarray, sin, cos, tan, sqrt, arctan2, radians, degrees, abs as np_abs, empty, full, isfinite,
+                                                    trunc, unique, concatenate, int64, float64, nan)
+from pandas import Index
+
+# Airy 1830 ellipsoid and National Grid projection
+# ================================================
+AIRY_A, AIRY_B = 6377563.396, 6356256.909
+F0 = 0.9996012717
+LAT0 = radians(49.0)
+LON0 = radians(-2.0)
+E0, N0 = 400000.0, -100000.0
+
+# GRS80 ellipsoid as used by WGS84
+# ================================
+GRS80_A, GRS80_B = 6378137.000, 6356752.3141
+
+# Helmert transformation from WGS84 to OSGB36, rotations in seconds of arc and scale in parts per million
+# ======================================================================================================
+HELMERT = {'tx': -446.448, 'ty': 125.157, 'tz': -542.060, 'rx': -0.1502, 'ry': -0.2470, 'rz': -0.8421, 's': 20.4894}
+
+MAX_ITERATIONS = 20
+LATTICE_KEY_FACTOR = 10000000   # lattice eastings and northings in metres are less than this
+
+_lattice = {'index': None, 'lons': empty(0), 'lats': empty(0)}    # cache of lattice point conversions
+
+def _meridional_arc(lat):
+    """
+    developed meridional arc from the true origin to latitude lat, in radians
+    """
+    n = (AIRY_A - AIRY_B) / (AIRY_A + AIRY_B)
+    dlat, slat = lat - LAT0, lat + LAT0
+    m1 = (1 + n + (5/4)*n**2 + (5/4)*n**3) * dlat
+    m2 = (3*n + 3*n**2 + (21/8)*n**3) * sin(dlat) * cos(slat)
+    m3 = ((15/8)*n**2 + (15/8)*n**3) * sin(2*dlat) * cos(2*slat)
+    m4 = (35/24)*n**3 * sin(3*dlat) * cos(3*slat)
+
+    return AIRY_B * F0 * (m1 - m2 + m3 - m4)
+
+def _radii(lat, a, e2):
+    """
+    transverse and meridional radii of curvature, scaled by F0
+    """
+    sin2 = sin(lat)**2
+    nu = a * F0 / sqrt(1 - e2*sin2)
+    rho = a * F0 * (1 - e2) * (1 - e2*sin2)**(-1.5)
+
+    return nu, rho
+
+def _to_cartesian(lat, lon, a, b):
+    """
+    geodetic latitude and longitude in radians, at zero height, to cartesian coordinates
+    """
+    e2 = 1 - (b*b)/(a*a)
+    nu = a / sqrt(1 - e2*sin(lat)**2)
+
+    return nu*cos(lat)*cos(lon), nu*cos(lat)*sin(lon), (1 - e2)*nu*sin(lat)
+
+def _from_cartesian(x, y, z, a, b):
+    """
+    cartesian coordinates to geodetic latitude and longitude in radians
+    """
+    e2 = 1 - (b*b)/(a*a)
+    p = sqrt(x**2 + y**2)
+    lat = arctan2(z, p*(1 - e2))
+    for iteration in range(MAX_ITERATIONS):
+        nu = a / sqrt(1 - e2*sin(lat)**2)
+        lat_new = arctan2(z + e2*nu*sin(lat), p)
+        converged = not (np_abs(lat_new - lat) > 1.0e-15).any()
+        lat = lat_new
+        if converged:
+            break
+
+    return lat, arctan2(y, x)
+
+def _helmert(x, y, z, sign):
+    """
+    apply Helmert transformation from WGS84 to OSGB36 when sign is 1, or the reverse when sign is -1
+    """
+    tx, ty, tz = [sign*HELMERT[key] for key in ('tx', 'ty', 'tz')]
+    rx, ry, rz = [sign*radians(HELMERT[key]/3600.0) for key in ('rx', 'ry', 'rz')]
+    s = sign*HELMERT['s']*1.0e-6
+
+    return (tx + (1 + s)*x - rz*y + ry*z,
+            ty + rz*x + (1 + s)*y - rx*z,
+            tz - ry*x + rx*y + (1 + s)*z)
+
+def wgs84_to_osgb36(lons, lats):
+    """
+    convert arrays of WGS84 longitudes and latitudes in degrees to OSGB36 eastings and northings in metres
+    """
+    lons = asarray(lons, dtype=float64)
+    lats = asarray(lats, dtype=float64)
+
+    x, y, z = _to_cartesian(radians(lats), radians(lons), GRS80_A, GRS80_B)
+    lat, lon = _from_cartesian(*_helmert(x, y, z, 1), AIRY_A, AIRY_B)
+
+    e2 = 1 - (AIRY_B*AIRY_B)/(AIRY_A*AIRY_A)
+    nu, rho = _radii(lat, AIRY_A, e2)
+    eta2 = nu/rho - 1
+    tan_lat = tan(lat)
+    cos_lat = cos(lat)
+
+    term_1 = _meridional_arc(lat) + N0
+    term_2 = nu/2 * sin(lat)*cos_lat
+    term_3 = nu/24 * sin(lat)*cos_lat**3 * (5 - tan_lat**2 + 9*eta2)
+    term_3a = nu/720 * sin(lat)*cos_lat**5 * (61 - 58*tan_lat**2 + tan_lat**4)
+    term_4 = nu*cos_lat
+    term_5 = nu/6 * cos_lat**3 * (nu/rho - tan_lat**2)
+    term_6 = nu/120 * cos_lat**5 * (5 - 18*tan_lat**2 + tan_lat**4 + 14*eta2 - 58*tan_lat**2*eta2)
+
+    dlon = lon - LON0
+    nrthings = term_1 + term_2*dlon**2 + term_3*dlon**4 + term_3a*dlon**6
+    eastings = E0 + term_4*dlon + term_5*dlon**3 + term_6*dlon**5
+
+    return eastings, nrthings
+
+def osgb36_to_wgs84(eastings, nrthings):
+    """
+    convert arrays of OSGB36 eastings and northings in metres to WGS84 longitudes and latitudes in degrees
+    """
+    eastings = asarray(eastings, dtype=float64)
+    nrthings = asarray(nrthings, dtype=float64)
+
+    # latitude for which the meridional arc equals the northing, accurate to 0.01mm
+    # ==============================================================================
+    lat = full(nrthings.shape, LAT0)
+    arc = full(nrthings.shape, 0.0)
+    for iteration in range(MAX_ITERATIONS):
+        lat = (nrthings - N0 - arc)/(AIRY_A*F0) + lat
+        arc = _meridional_arc(lat)
+        if not (np_abs(nrthings - N0 - arc) >= 1.0e-5).any():
+            break
+
+    e2 = 1 - (AIRY_B*AIRY_B)/(AIRY_A*AIRY_A)
+    nu, rho = _radii(lat, AIRY_A, e2)
+    eta2 = nu/rho - 1
+    tan_lat = tan(lat)
+    sec_lat = 1.0/cos(lat)
+
+    term_7 = tan_lat/(2*rho*nu)
+    term_8 = tan_lat/(24*rho*nu**3) * (5 + 3*tan_lat**2 + eta2 - 9*tan_lat**2*eta2)
+    term_9 = tan_lat/(720*rho*nu**5) * (61 + 90*tan_lat**2 + 45*tan_lat**4)
+    term_10 = sec_lat/nu
+    term_11 = sec_lat/(6*nu**3) * (nu/rho + 2*tan_lat**2)
+    term_12 = sec_lat/(120*nu**5) * (5 + 28*tan_lat**2 + 24*tan_lat**4)
+    term_12a = sec_lat/(5040*nu**7) * (61 + 662*tan_lat**2 + 1320*tan_lat**4 + 720*tan_lat**6)
+
+    de = eastings - E0
+    lat_airy = lat - term_7*de**2 + term_8*de**4 - term_9*de**6
+    lon_airy = LON0 + term_10*de - term_11*de**3 + term_12*de**5 - term_12a*de**7
+
+    x, y, z = _to_cartesian(lat_airy, lon_airy, AIRY_A, AIRY_B)
+    lat, lon = _from_cartesian(*_helmert(x, y, z, -1), GRS80_A, GRS80_B)
+
+    return degrees(lon), degrees(lat)
+
+def lattice_to_wgs84(eastings, nrthings):
+    """
+    as osgb36_to_wgs84 but conversions of integral coordinates, such as the 1 km lattice, are cached for the session
+    """
+    eastings = asarray(eastings, dtype=float64)
+    nrthings = asarray(nrthings, dtype=float64)
+    lons = full(eastings.shape, nan)
+    lats = full(eastings.shape, nan)
+
+    finite = isfinite(eastings) & isfinite(nrthings)
+    lattice = finite & (eastings == trunc(eastings)) & (nrthings == trunc(nrthings)) & (eastings >= 0) & (nrthings >= 0)
+    others = finite & ~lattice
+    lons[others], lats[others] = osgb36_to_wgs84(eastings[others], nrthings[others])
+
+    keys = eastings[lattice].astype(int64)*LATTICE_KEY_FACTOR + nrthings[lattice].astype(int64)
+    positions = _fetch_lattice_positions(keys)
+    if (positions < 0).any():
+        new_keys = unique(keys[positions < 0])
+        new_lons, new_lats = osgb36_to_wgs84(new_keys // LATTICE_KEY_FACTOR, new_keys % LATTICE_KEY_FACTOR)
+        _lattice['lons'] = concatenate((_lattice['lons'], new_lons))
+        _lattice['lats'] = concatenate((_lattice['lats'], new_lats))
+        old_keys = [] if _lattice['index'] is None else _lattice['index'].values
+        _lattice['index'] = Index(concatenate((old_keys, new_keys)).astype(int64))
+        positions = _fetch_lattice_positions(keys)
+
+    lons[lattice] = _lattice['lons'][positions]
+    lats[lattice] = _lattice['lats'][positions]
+
+    return lons, lats
+
+def _fetch_lattice_positions(keys):
+    """
+    positions of keys in the lattice cache, -1 where absent
+    """
+    if _lattice['index'] is None:
+        return full(len(keys), -1, dtype=int64)
+
+    return _lattice['index'].get_indexer(keys)
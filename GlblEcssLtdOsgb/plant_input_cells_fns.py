@@ -0,0 +1,172 @@
+#-------------------------------------------------------------------------------
+# Name:        plant_input_cells_fns.py
+# Purpose:     batched extraction of plant inputs for sets of grid cells
+# Licence:     <your licence>
+# Description:
+#   plant inputs for the cells of a GridCellSet are read from the plant input NetCDF file, see piNcFname, one block of
+#   the plant input grid at a time with fancy indexing, and attached to the set as column plant_input so that writers
+#   need not open the file
+#   series are retained for the session against the identity of the file and the grid_ref; entries are evicted on a
+#   least recently used basis once PI_CACHE_MB is exceeded so that memory remains bounded over many SPATIAL tiles
+#-------------------------------------------------------------------------------
+
+__prog__ = 'plant_input_cells_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from collections import OrderedDict
+from os.path import isfile
+
+from numpy import asarray, full, stack, argsort, diff, flatnonzero, split, float32, int64, nan
+from numpy.ma import filled
+
+from nc_dset_pool import fetch_nc_dset
+from chess_valid_land_fns import fetch_file_identity
+from osgb_coord_fns import osgb36_to_wgs84
+from land_use_mask_fns import find_grid_variable, fetch_nearest_indices
+
+ERROR_STR = '*** Error *** '
+WARN_STR = '*** Warning *** '
+
+PI_CACHE_MB = 256       # memory budget for series retained during the session
+PI_BLOCK_SIDE = 64      # maximum side, in plant input grid cells, of a block read in one go
+
+class PlantInputCache(object,):
+
+    def __init__(self, max_mb = PI_CACHE_MB):
+        """
+        in-memory series of plant inputs keyed by file identity and grid_ref, in order of last access
+        """
+        self.max_bytes = max_mb*1024*1024
+        self.nbytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, pi_id, grid_ref):
+        """
+        return series of plant inputs, or None if not present
+        """
+        key = (pi_id, grid_ref)
+        if key not in self.entries:
+            return None
+
+        self.entries.move_to_end(key)
+
+        return self.entries[key]
+
+    def put(self, pi_id, grid_ref, series):
+        """
+        store series of plant inputs then evict least recently used entries until the cache is within budget
+        """
+        key = (pi_id, grid_ref)
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key).nbytes
+
+        self.entries[key] = series
+        self.nbytes += series.nbytes
+
+        while self.nbytes > self.max_bytes and len(self.entries) > 0:
+            key, evicted = self.entries.popitem(last = False)
+            self.nbytes -= evicted.nbytes
+
+        return
+
+_plant_inputs = PlantInputCache()
+
+def attach_plant_inputs(form, valid_land, grid_cells):
+    """
+    add column plant_input, an array of cells by time steps with NaN where the file has no value, to the cell set
+    only cells not retained from earlier in this session are read
+    """
+    func_name = __prog__ + '  attach_plant_inputs'
+
+    if not form.w_use_pi_nc.isChecked() or len(grid_cells) == 0:
+        return
+
+    pi_nc_fname = form.w_lbl_pi_nc.text()
+    if not isfile(pi_nc_fname):
+        print(WARN_STR + 'plant input file ' + pi_nc_fname + ' does not exist')
+        return
+
+    pi_id = fetch_file_identity(pi_nc_fname)
+    grid_refs = grid_cells.keys()
+    cell_series = [_plant_inputs.get(pi_id, grid_ref) for grid_ref in grid_refs]
+    irows = asarray([irow for irow, series in enumerate(cell_series) if series is None], dtype=int64)
+
+    if len(irows) > 0:
+        try:
+            series_read = _read_plant_inputs(pi_nc_fname, valid_land, grid_cells.indx_nrth[irows],
+                                                                                    grid_cells.indx_east[irows])
+        except ValueError as err:
+            print(ERROR_STR + 'could not read plant inputs: {}'.format(err))
+            return
+
+        for irow, series in zip(irows.tolist(), series_read):
+            cell_series[irow] = series.copy()       # copies so that cached rows do not retain the whole array
+            _plant_inputs.put(pi_id, grid_refs[irow], cell_series[irow])
+
+    grid_cells.columns['plant_input'] = stack(cell_series)
+
+    mess = 'Attached plant inputs to {} cells, {} read from {}'.format(len(grid_refs), len(irows), pi_nc_fname)
+    form.lgr.info(mess + ' in function ' + func_name)
+
+    return
+
+def _fetch_pi_block_side(pi_var):
+    """
+    return the row and column sides, in plant input grid cells, of the blocks used to read a plant input variable
+    blocks are aligned with the spatial chunks of the file and are at most PI_BLOCK_SIDE a side
+    """
+    chunking = pi_var.chunking()
+    if chunking == 'contiguous' or chunking is None:
+        return PI_BLOCK_SIDE, PI_BLOCK_SIDE
+
+    return min(chunking[-2], PI_BLOCK_SIDE), min(chunking[-1], PI_BLOCK_SIDE)
+
+def _plan_pi_blocks(pi_rows, pi_cols, side_row, side_col):
+    """
+    group cells lying within the plant input grid into blocks, as _plan_block_reads does in getClimGenOsbgFns.py
+    returns a list of arrays of cell indices, one per block, with blocks in the order of the file's layout
+    """
+    inside = flatnonzero((pi_rows >= 0) & (pi_cols >= 0))
+    if len(inside) == 0:
+        return []
+
+    ntile_cols = int(pi_cols[inside].max()) // side_col + 1
+    tile_keys = (pi_rows[inside] // side_row)*ntile_cols + pi_cols[inside] // side_col
+    order = argsort(tile_keys, kind='stable')
+
+    return split(inside[order], flatnonzero(diff(tile_keys[order])) + 1)
+
+def _read_plant_inputs(pi_nc_fname, valid_land, indx_nrths, indx_easts):
+    """
+    series of plant inputs, an array of cells by time steps, for cells of the CHESS grid
+    cells are matched at their centres, as for the land use mask; each block is read as one window across all time
+    steps; where the variable has no leading dimensions each series has one value
+    """
+    nc_vars = fetch_nc_dset(pi_nc_fname).variables
+    x_name, y_name, pi_var = find_grid_variable(nc_vars, 'plant input file ' + pi_nc_fname)
+
+    xvals = valid_land.min_easting + (indx_easts + 0.5)*valid_land.gridsize
+    yvals = valid_land.min_nrthing + (indx_nrths + 0.5)*valid_land.gridsize
+    if x_name != 'x':
+        xvals, yvals = osgb36_to_wgs84(xvals, yvals)
+
+    pi_cols = fetch_nearest_indices(nc_vars[x_name][:], xvals)
+    pi_rows = fetch_nearest_indices(nc_vars[y_name][:], yvals)
+
+    nsteps = 1
+    for dim_size in pi_var.shape[:-2]:
+        nsteps *= dim_size
+
+    series = full((len(indx_nrths), nsteps), nan, dtype=float32)
+    side_row, side_col = _fetch_pi_block_side(pi_var)
+    for cells in _plan_pi_blocks(pi_rows, pi_cols, side_row, side_col):
+        row_lo, row_hi = int(pi_rows[cells].min()), int(pi_rows[cells].max()) + 1
+        col_lo, col_hi = int(pi_cols[cells].min()), int(pi_cols[cells].max()) + 1
+        window = filled(pi_var[..., row_lo:row_hi, col_lo:col_hi].astype(float32), nan)
+        window = window.reshape(nsteps, row_hi - row_lo, col_hi - col_lo)
+        series[cells] = window[:, pi_rows[cells] - row_lo, pi_cols[cells] - col_lo].T
+
+    return series
@@ -45,14 +45,15 @@ def make_ecss_files_from_cell(form, climgen, ltd_data, grid_cell):
     fut_clim_scen = climgen.fut_clim_scen
 
     # write stanza for input.txt file consisting of long term average climate
+    # LTAs are pre-rounded, see _gather_ltas in getClimGenOsbgFns.py
     # =======================================================================
     hist_wthr_recs = []
     for imnth, month in enumerate(climgen.months):
-        hist_wthr_recs.append(input_txt_line_layout('{}'.format(round(lta['precip'][imnth], 1)), \
+        hist_wthr_recs.append(input_txt_line_layout('{}'.format(lta['precip'][imnth]), \
                                             '{} long term average monthly precipitation [mm]'.format(month)))
 
     for imnth, month in enumerate(climgen.months):
-        hist_wthr_recs.append(input_txt_line_layout('{}'.format(round(lta['tas'][imnth], 2)), \
+        hist_wthr_recs.append(input_txt_line_layout('{}'.format(lta['tas'][imnth]), \
                                             '{} long term average monthly temperature [degC]'.format(month)))
 
     #------------------------------------------------------------------
@@ -72,8 +73,9 @@ def make_ecss_files_from_cell(form, climgen, ltd_data, grid_cell):
         soil_list = form.hwsd_mu_globals.soil_recs[mu_global]
 
         for soil_num, soil in enumerate(soil_list):
-            # identifer = grid_cell.grid_ref + '_mu{:0=5d}_s{:0=2d}'.format(mu_global, soil_num + 1)
-            identifer = grid_cell.grid_ref + '_s{:0=2d}'.format(soil_num + 1)
+            # cells may comprise several mu_globals so the mu_global is part of the identifier
+            # ================================================================================
+            identifer = grid_cell.grid_ref + '_mu{:0=5d}_s{:0=2d}'.format(mu_global, soil_num + 1)
 
             sim_dir = join(sims_dir, climgen.study, identifer)
             if not lexists(sim_dir):
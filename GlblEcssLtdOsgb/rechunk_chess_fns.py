@@ -0,0 +1,185 @@
+#-------------------------------------------------------------------------------
+# Name:        rechunk_chess_fns.py
+# Purpose:     convert time-major CHESS NetCDF files to a cell-major layout
+# Licence:     <your licence>
+# Description:
+#   CHESS files are chunked by time so that reading the full time series of one cell touches hundreds of chunks
+#   this script rewrites each file with chunks comprising the full time axis for a square tile of cells
+#
+#   usage: python rechunk_chess_fns.py [-m MEMORY_MB] [-t TILE] store_dir nc_file [nc_file ...]
+#-------------------------------------------------------------------------------
+#!/usr/bin/env python
+
+__prog__ = 'rechunk_chess_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from argparse import ArgumentParser
+from os.path import isfile, join, normpath, basename, lexists, getsize, getmtime
+from os import makedirs, remove, rename
+from time import time
+
+from netCDF4 import Dataset
+
+from nc_dset_pool import fetch_nc_dset, evict_nc_dsets
+
+ERROR_STR = '*** Error *** '
+WARN_STR = '*** Warning *** '
+
+CELL_MAJOR_DIR = 'chess_cell_major'     # sub-directory of the cache directory holding converted files
+SOURCE_ATTR = 'source_identity'         # global attribute identifying the file a converted file was made from
+TILE_DFLT = 16                          # side, in grid cells, of the spatial tile of each chunk
+MEMORY_MB_DFLT = 512                    # memory budget for the conversion
+COMPLEVEL = 4
+
+def _source_identity(fname):
+    """
+    path, size and modification time of the source file
+    """
+    fname = normpath(fname)
+
+    return '{}|{}|{}'.format(fname, getsize(fname), int(getmtime(fname)))
+
+def fetch_cell_major_fname(store_dir, fname):
+    """
+    return the converted equivalent of a CHESS file if it exists and was made from the current version of the file
+    otherwise return the original file name
+    """
+    cell_major_fn = join(store_dir, basename(fname))
+    if not isfile(cell_major_fn) or not isfile(fname):
+        return fname
+
+    try:
+        source_identity = fetch_nc_dset(cell_major_fn).getncattr(SOURCE_ATTR)
+    except (OSError, AttributeError) as err:
+        print(WARN_STR + 'ignoring converted file {}: {}'.format(cell_major_fn, err))
+        evict_nc_dsets(cell_major_fn)
+        return fname
+
+    if source_identity != _source_identity(fname):
+        print(WARN_STR + 'converted file ' + cell_major_fn + ' is out of date - rerun ' + __prog__)
+        evict_nc_dsets(cell_major_fn)
+        return fname
+
+    return cell_major_fn
+
+def _fetch_spatial_vars(nc_dset):
+    """
+    names of variables with time, y and x dimensions
+    """
+    return [var_name for var_name, nc_var in nc_dset.variables.items() if len(nc_var.dimensions) == 3]
+
+def convert_chess_file(fname, store_dir, memory_mb = MEMORY_MB_DFLT, tile = TILE_DFLT):
+    """
+    stream a time-major file into a copy chunked by spatial tile with the full time axis
+    each strip of tiles, one tile high, is filled one group of tiles and one block of time steps at a time with the
+    group's chunks held in the chunk cache until complete so that every output chunk is compressed once
+    groups are as wide as half of memory_mb allows; peak memory is bounded by memory_mb unless a single chunk needs
+    more than half of it, in which case a warning is given
+    """
+    if not lexists(store_dir):
+        makedirs(store_dir)
+
+    out_fn = join(store_dir, basename(fname))
+    tmp_fn = out_fn + '.part'
+    evict_nc_dsets(out_fn)     # release any handle on a previous conversion
+    budget = memory_mb*1024*1024
+
+    src = Dataset(fname, 'r')
+    out = Dataset(tmp_fn, 'w', format='NETCDF4')
+    out.setncatts({attr: src.getncattr(attr) for attr in src.ncattrs()})
+    out.setncattr(SOURCE_ATTR, _source_identity(fname))
+
+    for dim_name, dim in src.dimensions.items():
+        out.createDimension(dim_name, None if dim.isunlimited() else len(dim))
+
+    spatial_vars = _fetch_spatial_vars(src)
+    for var_name, src_var in src.variables.items():
+        src_var.set_auto_maskandscale(False)
+        var_attrs = {attr: src_var.getncattr(attr) for attr in src_var.ncattrs() if attr != '_FillValue'}
+        fill_value = src_var.getncattr('_FillValue') if '_FillValue' in src_var.ncattrs() else None
+
+        if var_name in spatial_vars:
+            ntsteps, nrows, ncols = src_var.shape
+            chunksizes = (ntsteps, min(tile, nrows), min(tile, ncols))
+            out_var = out.createVariable(var_name, src_var.dtype, src_var.dimensions, zlib=True,
+                                        complevel=COMPLEVEL, chunksizes=chunksizes, fill_value=fill_value)
+        else:
+            out_var = out.createVariable(var_name, src_var.dtype, src_var.dimensions, fill_value=fill_value)
+
+        out_var.setncatts(var_attrs)
+        out_var.set_auto_maskandscale(False)
+        if var_name not in spatial_vars:
+            out_var[...] = src_var[...]
+
+    # copy spatial variables one strip of tiles at a time
+    # ===================================================
+    for var_name in spatial_vars:
+        src_var = src.variables[var_name]
+        out_var = out.variables[var_name]
+        ntsteps, nrows, ncols = src_var.shape
+        itemsize = src_var.dtype.itemsize
+
+        # groups comprise whole chunks so that no chunk is written by more than one group
+        # ================================================================================
+        strip_rows, tile_cols = out_var.chunking()[1:]
+        chunk_bytes = ntsteps*strip_rows*tile_cols*itemsize
+        group_cols = min(ncols, max(1, (budget // 2) // chunk_bytes)*tile_cols)
+        group_bytes = ntsteps*strip_rows*group_cols*itemsize
+        if group_bytes > budget // 2:
+            print(WARN_STR + 'a chunk of {} needs {} MB which exceeds half the memory budget of {} MB'
+                                                .format(var_name, round(chunk_bytes/(1024*1024), 1), memory_mb))
+
+        out_var.set_var_chunk_cache(size=group_bytes + 1024*1024)
+        tblock = max(1, max(budget - group_bytes, budget // 2) // (strip_rows*group_cols*itemsize))
+
+        print('Converting {} of {} with groups of {} rows by {} columns and blocks of {} time steps'
+                                                            .format(var_name, fname, strip_rows, group_cols, tblock))
+        start_time = time()
+        for nrth_lo in range(0, nrows, strip_rows):
+            nrth_hi = min(nrth_lo + strip_rows, nrows)
+            for east_lo in range(0, ncols, group_cols):
+                east_hi = min(east_lo + group_cols, ncols)
+                for tstep_lo in range(0, ntsteps, tblock):
+                    tstep_hi = min(tstep_lo + tblock, ntsteps)
+                    out_var[tstep_lo:tstep_hi, nrth_lo:nrth_hi, east_lo:east_hi] = \
+                                                    src_var[tstep_lo:tstep_hi, nrth_lo:nrth_hi, east_lo:east_hi]
+
+                out.sync()     # flush the completed group from the chunk cache
+
+        print('\tdone in {} seconds'.format(round(time() - start_time, 1)))
+
+    src.close()
+    out.close()
+
+    if isfile(out_fn):
+        remove(out_fn)
+    rename(tmp_fn, out_fn)
+    print('Wrote ' + out_fn)
+
+    return out_fn
+
+def main():
+    """
+    convert the four CHESS inputs i.e. historic and future precipitation and temperature
+    the store directory is normally the chess_cell_major sub-directory of the cache directory
+    """
+    parser = ArgumentParser(description='Convert CHESS NetCDF files to a cell-major layout')
+    parser.add_argument('store_dir', help='directory for converted files')
+    parser.add_argument('nc_fnames', nargs='+', help='CHESS NetCDF files to convert')
+    parser.add_argument('-m', '--memory', type=int, default=MEMORY_MB_DFLT, help='memory budget in MB')
+    parser.add_argument('-t', '--tile', type=int, default=TILE_DFLT, help='side of spatial tile in grid cells')
+    args = parser.parse_args()
+
+    for fname in args.nc_fnames:
+        if isfile(fname):
+            convert_chess_file(fname, args.store_dir, args.memory, args.tile)
+        else:
+            print(ERROR_STR + fname + ' does not exist')
+
+    return
+
+if __name__ == '__main__':
+    main()
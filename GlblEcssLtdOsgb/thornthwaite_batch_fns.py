@@ -0,0 +1,97 @@
+#-------------------------------------------------------------------------------
+# Name:        thornthwaite_batch_fns.py
+# Purpose:     Thornthwaite PET and precipitation totals for many cells and years at once
+# Licence:     <your licence>
+# Description:
+#   monthly series of cells, arrays of cells by months, are reshaped to cells by years by months and converted with
+#   array arithmetic; mean daylight hours and days in month are computed once per latitude and year range
+#   PET follows the Thornthwaite (1948) formulation used by thornthwaite.py: negative temperatures are taken as zero,
+#   daylight hours are the monthly means of the daily sunset hour angle and PET is zero for years without a month
+#   above zero degrees; years with missing temperatures give NaN
+#-------------------------------------------------------------------------------
+
+__prog__ = 'thornthwaite_batch_fns.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from calendar import isleap, monthrange
+
+from numpy import (asarray, array, arange, sin, tan, arccos, clip, cumsum, concatenate, add, maximum, where, errstate,
+                                                                                                float64, pi)
+
+MNTHS_YR = 12
+numSecsDay = 3600*24
+KELVIN_OFFSET = 273.15      # CHESS Near-Surface air temperature is in Kelvin
+
+DAYS_IN_MNTHS = {False: array([monthrange(2001, imnth)[1] for imnth in range(1, MNTHS_YR + 1)]),
+                 True:  array([monthrange(2000, imnth)[1] for imnth in range(1, MNTHS_YR + 1)])}   # keyed by isleap
+
+def fetch_days_in_months(strt_year, nyears):
+    """
+    array of years by months of the number of days in each month
+    """
+    return array([DAYS_IN_MNTHS[isleap(year)] for year in range(strt_year, strt_year + nyears)])
+
+def _fetch_daylight_hours(lats, leap_flag):
+    """
+    array of cells by months of mean daylight hours for latitudes in degrees
+    """
+    days_in_mnths = DAYS_IN_MNTHS[leap_flag]
+    sol_dec = 0.409*sin((2.0*pi/365.0)*arange(1, days_in_mnths.sum() + 1) - 1.39)     # solar declination, radians
+
+    lats_rad = asarray(lats, dtype=float64)*(pi/180.0)
+    sunset_angle = arccos(clip(-tan(lats_rad)[:, None]*tan(sol_dec)[None, :], -1.0, 1.0))
+    mnth_strts = concatenate(([0], cumsum(days_in_mnths)[:-1]))
+
+    return add.reduceat((24.0/pi)*sunset_angle, mnth_strts, axis=1) / days_in_mnths
+
+def fetch_daylight_hours(lats, strt_year, nyears):
+    """
+    array of cells by years by months of mean daylight hours, computed once for each of leap and other years
+    """
+    leap_flags = array([isleap(year) for year in range(strt_year, strt_year + nyears)])
+    daylight = {leap_flag: _fetch_daylight_hours(lats, leap_flag) for leap_flag in (False, True)}
+
+    return where(leap_flags[None, :, None], daylight[True][:, None, :], daylight[False][:, None, :])
+
+def thornthwaite_batch(temp_mean, daylight_hours, days_in_mnths):
+    """
+    PET in mm per month for an array of cells by years by months of mean temperatures in degrees Celsius
+    """
+    temp_adj = maximum(temp_mean, 0.0)
+    heat_indx = ((temp_adj/5.0)**1.514).sum(axis=-1, keepdims=True)
+    expnt = (6.75e-07*heat_indx**3) - (7.71e-05*heat_indx**2) + (1.792e-02*heat_indx) + 0.49239
+
+    with errstate(divide='ignore', invalid='ignore'):
+        pet = 1.6*(daylight_hours/12.0)*(days_in_mnths/30.0)*((10.0*temp_adj/heat_indx)**expnt)*10.0
+
+    return where(heat_indx == 0.0, 0.0, pet)       # years with missing temperatures remain NaN
+
+def fetch_met_arrays(precip, tas, lats, strt_year):
+    """
+    precipitation in mm per month, PET in mm per month and mean temperature in degrees Celsius, each an array of
+    cells by years by months, from arrays of cells by months of precipitation in kg m-2 s-1 and temperature in Kelvin
+    only complete years are converted
+    """
+    precip = asarray(precip)
+    tas = asarray(tas)
+    ncells, nmnths = tas.shape
+    nyears = nmnths // MNTHS_YR
+    nmnths = nyears*MNTHS_YR
+
+    # values are upcast from float32 before any arithmetic
+    # ====================================================
+    temp_mean = tas[:, :nmnths].astype(float64).reshape(ncells, nyears, MNTHS_YR) - KELVIN_OFFSET
+    precip_mnths = precip[:, :nmnths].astype(float64).reshape(ncells, nyears, MNTHS_YR)
+
+    days_in_mnths = fetch_days_in_months(strt_year, nyears)
+    daylight_hours = fetch_daylight_hours(lats, strt_year, nyears)
+
+    # convert precipitation with units: kg m-2 s-1 to mm per month
+    # ============================================================
+    precips = precip_mnths * numSecsDay * days_in_mnths
+    pets = thornthwaite_batch(temp_mean, daylight_hours, days_in_mnths)
+
+    return precips, pets, temp_mean
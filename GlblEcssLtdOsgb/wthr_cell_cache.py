@@ -0,0 +1,133 @@
+#-------------------------------------------------------------------------------
+# Name:        wthr_cell_cache.py
+# Purpose:     disk cache of CHESS weather series extracted for individual grid cells
+# Licence:     <your licence>
+# Description:
+#   each entry is a float32 array of precipitation and temperature series stored as a .npy file which is read back
+#   as a memory map; entries are evicted on a least recently used basis once the disk budget is exceeded
+#-------------------------------------------------------------------------------
+
+__prog__ = 'wthr_cell_cache.py'
+__version__ = '0.0.0'
+
+# Version history
+# ---------------
+#
+from os.path import isfile, join, lexists, getsize, getmtime
+from os import makedirs, remove, listdir
+from hashlib import md5
+from json import load as json_load, dump as json_dump, JSONDecodeError
+from time import time
+
+from numpy import load as np_load, save as np_save, stack, float32
+
+WARN_STR = '*** Warning *** '
+
+WTHR_CACHE_DIR = 'wthr_cells'
+INDEX_FNAME = 'index.json'
+CACHE_MB_DFLT = 2048
+METRICS = ['precip', 'tas']
+
+class WthrCellCache(object,):
+
+    def __init__(self, lggr, cache_dir, max_mb = CACHE_MB_DFLT):
+        """
+        the index records the size and time of last access of each entry and is rebuilt from the directory if lost
+        """
+        self.lggr = lggr
+        self.cache_dir = join(cache_dir, WTHR_CACHE_DIR)
+        self.max_bytes = max_mb*1024*1024
+        self.index_fn = join(self.cache_dir, INDEX_FNAME)
+        self.nhits = 0
+        self.nmisses = 0
+
+        if not lexists(self.cache_dir):
+            makedirs(self.cache_dir)
+
+        self.index = None
+        if isfile(self.index_fn):
+            try:
+                with open(self.index_fn, 'r') as fobj:
+                    self.index = json_load(fobj)
+            except (OSError, JSONDecodeError) as err:
+                lggr.info(WARN_STR + 'could not read weather cache index {}: {}'.format(self.index_fn, err))
+
+        if self.index is None:
+            self.index = {}
+            for fname in listdir(self.cache_dir):
+                if fname.endswith('.npy'):
+                    long_fname = join(self.cache_dir, fname)
+                    self.index[fname[:-4]] = {'size': getsize(long_fname), 'atime': getmtime(long_fname)}
+
+    @staticmethod
+    def make_key(dset_ids, scenario, realis, wndw, grid_ref):
+        """
+        key comprises identities of the weather datasets, scenario, realisation, time window and grid_ref
+        """
+        key_str = '|'.join([str(dset_id) for dset_id in dset_ids] + [scenario, realis, str(wndw), grid_ref])
+
+        return md5(key_str.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        return dictionary of memory mapped series, or None if not present
+        """
+        fname = join(self.cache_dir, key + '.npy')
+        if key not in self.index or not isfile(fname):
+            self.nmisses += 1
+            return None
+
+        series = np_load(fname, mmap_mode='r')
+        self.index[key]['atime'] = time()
+        self.nhits += 1
+
+        return {metric: series[indx] for indx, metric in enumerate(METRICS)}
+
+    def put(self, key, wthr):
+        """
+        store precipitation and temperature series of equal length for a cell
+        """
+        fname = join(self.cache_dir, key + '.npy')
+        np_save(fname, stack([wthr[metric] for metric in METRICS]).astype(float32))
+        self.index[key] = {'size': getsize(fname), 'atime': time()}
+
+        return
+
+    def evict(self):
+        """
+        remove least recently used entries until the cache is within budget
+        """
+        total_size = sum(entry['size'] for entry in self.index.values())
+        if total_size <= self.max_bytes:
+            return 0
+
+        nevicted = 0
+        for key in sorted(self.index, key = lambda key: self.index[key]['atime']):
+            fname = join(self.cache_dir, key + '.npy')
+            try:
+                remove(fname)
+            except FileNotFoundError:
+                pass
+            except PermissionError as err:
+                self.lggr.info(WARN_STR + 'could not evict {}: {}'.format(fname, err))
+                continue
+
+            total_size -= self.index.pop(key)['size']
+            nevicted += 1
+            if total_size <= self.max_bytes:
+                break
+
+        return nevicted
+
+    def flush(self):
+        """
+        apply the disk budget and write the index
+        """
+        nevicted = self.evict()
+        with open(self.index_fn, 'w') as fobj:
+            json_dump(self.index, fobj)
+
+        mess = 'Weather cache: {} hits\t{} misses\t{} evicted'.format(self.nhits, self.nmisses, nevicted)
+        self.lggr.info(mess); print(mess)
+
+        return